@@ -0,0 +1,25 @@
+"""Shared setup for the benchmark scripts: makes tests/harness.py and the
+stubbed homeassistant package importable."""
+import logging
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'tests'))
+
+import harness  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def print_table(rows, columns):
+    widths = [
+        max(len(str(column)), *(len(str(row[index])) for row in rows))
+        for index, column in enumerate(columns)
+    ]
+    print('  '.join(
+        str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(
+            str(cell).ljust(width) for cell, width in zip(row, widths)))
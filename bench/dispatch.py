@@ -0,0 +1,69 @@
+"""Per-event dispatch latency of one controller whose tree has 10, 100 and
+1000 nodes, walked as a tree and through the compiled dispatch table.
+
+    python bench/dispatch.py [--sizes 10 100 1000] [--events 2000]
+                             [--no-cache]
+
+No override matches, so every event has to rule out all of them before it
+reaches the base strategy: the worst case for the tree walk.
+"""
+import argparse
+import time
+
+from common import harness, print_table
+
+import complex_controller
+
+
+async def async_measure(size, mode, events, cache_conditions):
+    harness.reset_integrations()
+    hass = harness.FakeHass()
+    config, lights = harness.make_room_controller('room', mode, size - 1)
+    config['cache_conditions'] = cache_conditions
+    harness.FakeLights(hass).add(*lights)
+    for i in range(size - 1):
+        hass.states.async_set(f'input_boolean.room_night_{i}', 'off')
+    assert await hass.async_setup_component('state_enforcer',
+                                            {'state_enforcer': lights})
+    assert await hass.async_setup_component('complex_controller',
+                                            {'complex_controller': {
+                                                'room': config
+                                            }})
+    await hass.async_block_till_done()
+    controller = complex_controller.controllers['room']
+    event = harness.Event('handle_event', {
+        'controller': 'room',
+        'type': 'movement'
+    })
+    latencies = list()
+    for _ in range(events):
+        began = time.perf_counter()
+        await controller.async_dispatch_event(event)
+        latencies.append(time.perf_counter() - began)
+        await hass.async_block_till_done()
+    return latencies
+
+
+async def async_main(args):
+    rows = list()
+    for size in args.sizes:
+        for mode in ('tree', 'compiled'):
+            latencies = await async_measure(size, mode, args.events,
+                                            not args.no_cache)
+            rows.append((size, mode,
+                         f'{harness.percentile(latencies, 0.5) * 1e6:.1f}',
+                         f'{harness.percentile(latencies, 0.99) * 1e6:.1f}'))
+    print_table(rows, ('nodes', 'mode', 'p50 us', 'p99 us'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--no-cache', action='store_true')
+    harness.run(async_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
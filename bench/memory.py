@@ -0,0 +1,73 @@
+"""Bytes allocated per state enforcer and per controller, measured with
+tracemalloc around the setup of each integration.
+
+    python bench/memory.py [--rooms 10 100 1000] [--overrides 3]
+
+Each room has two enforced lights and one controller. The light and sensor
+states are created before measuring, so only the integrations are counted;
+small houses are dominated by the fixed cost of setting up each integration.
+"""
+import argparse
+import gc
+import tracemalloc
+
+from common import harness, print_table
+
+
+def allocated_since(snapshot):
+    gc.collect()
+    current = tracemalloc.take_snapshot()
+    return sum(stat.size_diff
+               for stat in current.compare_to(snapshot, 'filename'))
+
+
+async def async_measure(count, overrides):
+    hass = harness.FakeHass()
+    lights = harness.FakeLights(hass)
+    controllers = dict()
+    entity_ids = list()
+    for i in range(count):
+        room = f'room_{i}'
+        controllers[room], room_lights = harness.make_room_controller(
+            room, overrides=overrides)
+        entity_ids.extend(room_lights)
+        lights.add(*room_lights)
+        hass.states.async_set(f'binary_sensor.{room}_motion', 'off')
+
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot()
+    assert await hass.async_setup_component('state_enforcer',
+                                            {'state_enforcer': entity_ids})
+    await hass.async_block_till_done()
+    enforcer_bytes = allocated_since(snapshot)
+
+    snapshot = tracemalloc.take_snapshot()
+    assert await hass.async_setup_component('complex_controller',
+                                            {'complex_controller': controllers})
+    await hass.async_block_till_done()
+    controller_bytes = allocated_since(snapshot)
+    return enforcer_bytes / len(entity_ids), controller_bytes / count
+
+
+async def async_main(args):
+    rows = list()
+    tracemalloc.start()
+    for count in args.rooms:
+        harness.reset_integrations()
+        per_enforcer, per_controller = await async_measure(
+            count, args.overrides)
+        rows.append((count, f'{per_enforcer:,.0f}', f'{per_controller:,.0f}'))
+    tracemalloc.stop()
+    print_table(rows, ('rooms', 'bytes/enforcer', 'bytes/controller'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--overrides', type=int, default=3)
+    harness.run(async_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Latency from a motion sensor turning on to the light service call, with
+config triggers and with an automation calling the handle_event service.
+
+    python bench/motion_latency.py [--rooms 20] [--events 2000]
+
+The automation path is modelled the way Home Assistant runs one: a state
+listener on the sensor that calls complex_controller.handle_event.
+"""
+import argparse
+import random
+import time
+
+from common import harness, print_table
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_state_change_event
+
+
+def add_automation(hass, room):
+    async def async_action(event):
+        await hass.services.async_call('complex_controller', 'handle_event', {
+            'controller': room,
+            'type': 'movement'
+        })
+
+    @callback
+    def on_motion(event):
+        if event.data['new_state'].state == 'on':
+            hass.async_create_task(async_action(event))
+
+    async_track_state_change_event(hass, f'binary_sensor.{room}_motion',
+                                   on_motion)
+
+
+async def async_measure(path, rooms, events, seed):
+    hass = harness.FakeHass()
+    lights = harness.FakeLights(hass)
+    controllers = dict()
+    entity_ids = list()
+    for room in rooms:
+        config, room_lights = harness.make_room_controller(room)
+        if path == 'service':
+            del config['triggers']
+            add_automation(hass, room)
+        controllers[room] = config
+        entity_ids.extend(room_lights)
+        lights.add(*room_lights)
+        hass.states.async_set(f'binary_sensor.{room}_motion', 'off')
+    assert await hass.async_setup_component('state_enforcer',
+                                            {'state_enforcer': entity_ids})
+    assert await hass.async_setup_component('complex_controller',
+                                            {'complex_controller': controllers})
+    await hass.async_block_till_done()
+
+    first_call = list()
+
+    def on_service_call(record):
+        if record.domain == 'light' and len(first_call) == 0:
+            first_call.append(record.perf)
+
+    hass.services.listeners.append(on_service_call)
+    generator = random.Random(seed)
+    latencies = list()
+    for _ in range(events):
+        room = generator.choice(rooms)
+        first_call.clear()
+        began = time.perf_counter()
+        hass.states.async_set(f'binary_sensor.{room}_motion', 'on')
+        await hass.async_block_till_done()
+        if len(first_call) > 0:
+            latencies.append(first_call[0] - began)
+        hass.states.async_set(f'binary_sensor.{room}_motion', 'off')
+        # Long enough for the lights to go off, so every event turns them on.
+        await hass.async_advance(200)
+    return latencies
+
+
+async def async_main(args):
+    rooms = [f'room_{i}' for i in range(args.rooms)]
+    rows = list()
+    for path in ('trigger', 'service'):
+        harness.reset_integrations()
+        latencies = await async_measure(path, rooms, args.events, args.seed)
+        rows.append((path, len(latencies),
+                     f'{harness.percentile(latencies, 0.5) * 1e6:.1f}',
+                     f'{harness.percentile(latencies, 0.99) * 1e6:.1f}'))
+    print_table(rows, ('path', 'samples', 'p50 us', 'p99 us'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    harness.run(async_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Replay a day of motion events across a house and report throughput,
+p50/p99 dispatch latency and the service calls issued.
+
+    python bench/replay.py [--rooms 50] [--mode tree|compiled]
+                           [--overrides 3] [--events stream.jsonl]
+
+--events replays a recorded stream instead (see harness.load_events).
+"""
+import argparse
+
+from common import harness
+
+
+async def async_main(args):
+    hass = harness.FakeHass()
+    rooms = [f'room_{i}' for i in range(args.rooms)]
+    await harness.async_setup_house(hass, rooms, args.mode, args.overrides)
+    if args.events is not None:
+        records = harness.load_events(args.events)
+    else:
+        records = harness.generate_motion_day(rooms, seed=args.seed)
+    report = await harness.async_replay(hass, records)
+    print(f'rooms: {args.rooms}, mode: {args.mode}, '
+          f'overrides per room: {args.overrides}')
+    print(report.format())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--mode', choices=('tree', 'compiled'), default='tree')
+    parser.add_argument('--overrides', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--events')
+    harness.run(async_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
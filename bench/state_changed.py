@@ -0,0 +1,56 @@
+"""state_changed throughput while unrelated entities churn, with 10 and with
+5000 of them, against a bare hass and against a house running both
+integrations.
+
+    python bench/state_changed.py [--unrelated 10 5000] [--rooms 20]
+                                  [--events 50000]
+
+Only enforced lights and trigger sensors should reach the integrations, so
+the rate with the house set up should stay close to the bare one no matter
+how many unrelated entities change.
+"""
+import argparse
+import time
+
+from common import harness, print_table
+
+
+async def async_measure(unrelated, rooms, events):
+    hass = harness.FakeHass()
+    if rooms > 0:
+        await harness.async_setup_house(
+            hass, [f'room_{i}' for i in range(rooms)], overrides=1)
+    entity_ids = [f'sensor.noise_{i}' for i in range(unrelated)]
+    for entity_id in entity_ids:
+        hass.states.async_set(entity_id, 0)
+    await hass.async_block_till_done()
+    began = time.perf_counter()
+    for i in range(events):
+        hass.states.async_set(entity_ids[i % unrelated], i)
+        if i % 100 == 0:
+            await hass.async_block_till_done()
+    await hass.async_block_till_done()
+    return events / (time.perf_counter() - began)
+
+
+async def async_main(args):
+    rows = list()
+    for unrelated in args.unrelated:
+        for rooms in (0, args.rooms):
+            harness.reset_integrations()
+            rate = await async_measure(unrelated, rooms, args.events)
+            rows.append((unrelated, rooms, f'{rate:,.0f}'))
+    print_table(rows, ('unrelated entities', 'rooms', 'events/s'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--unrelated', type=int, nargs='+',
+                        default=[10, 5000])
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--events', type=int, default=50000)
+    harness.run(async_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
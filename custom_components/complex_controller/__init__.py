@@ -1,21 +1,51 @@
 """The complex_controller integration."""
 import asyncio
+import collections
+import datetime
+import functools
+import heapq
+import itertools
 import logging
+import sys
+import time
+import types
 import voluptuous as vol
 import homeassistant.core
 import homeassistant.helpers.config_validation as cv
+import homeassistant.helpers.template as template_helper
+import homeassistant.util.dt as dt_util
+from homeassistant.exceptions import TemplateError
+from homeassistant.helpers.event import (async_track_state_change_event,
+                                         async_track_time_interval)
+from homeassistant.helpers.reload import async_integration_yaml_config
+from homeassistant.helpers.storage import Store
 from homeassistant.setup import async_setup_component
 from homeassistant.const import (ATTR_ENTITY_ID, CONF_CONDITION,
                                  CONF_ENTITY_ID, CONF_TYPE, CONF_BASE)
 
 from .const import *
 
+
+def service_data_templates(value):
+    """Compile template strings anywhere in service_data."""
+    if isinstance(value, dict):
+        return {
+            key: service_data_templates(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [service_data_templates(item) for item in value]
+    if isinstance(value, str) and template_helper.is_template_string(value):
+        return cv.template(value)
+    return value
+
+
 ACTION_SERVICE_SCHEMA = vol.Schema(
     {
         CONF_SERVICE:
         cv.entity_id,
         vol.Required(CONF_SERVICE_DATA, default=dict()):
-        vol.Schema({}, extra=vol.ALLOW_EXTRA)
+        vol.All(vol.Schema({}, extra=vol.ALLOW_EXTRA), service_data_templates)
     },
     required=True)
 
@@ -51,12 +81,36 @@ OVERRIDER_SCHEMA = BASE_SCHEMA.extend({
     CONF_OVERRIDES: [vol.Self]
 })
 
+TRIGGER_SCHEMA = vol.Schema(
+    {
+        CONF_ENTITY_ID: cv.entity_ids,
+        vol.Optional(CONF_TO): cv.string,
+        ATTR_EVENT_TYPE: vol.In(ALL_EVENT_TYPES)
+    },
+    required=True)
+
 CONFIG_SCHEMA = vol.Schema(
     {
         DOMAIN: {
             cv.string: {
                 vol.Optional(CONF_TIMER):
                 cv.entity_id,
+                vol.Required(CONF_DISPATCH_MODE, default=DISPATCH_MODE_TREE):
+                vol.In((DISPATCH_MODE_TREE, DISPATCH_MODE_COMPILED)),
+                vol.Required(CONF_CACHE_CONDITIONS, default=True):
+                cv.boolean,
+                vol.Optional(CONF_TRIGGERS):
+                [TRIGGER_SCHEMA],
+                vol.Required(CONF_TRANSITION_ATTRIBUTES, default=False):
+                cv.boolean,
+                vol.Required(CONF_DIAGNOSTICS, default=False):
+                cv.boolean,
+                vol.Required(CONF_COALESCE_WINDOW, default=0):
+                vol.All(vol.Coerce(float), vol.Range(min=0)),
+                vol.Required(CONF_EVENT_WINDOW, default=0):
+                vol.All(vol.Coerce(float), vol.Range(min=0)),
+                vol.Required(CONF_PRIORITY, default=0):
+                vol.Coerce(int),
                 CONF_BASE:
                 BASE_SCHEMA.extend(
                     {vol.Optional(CONF_OVERRIDES): [OVERRIDER_SCHEMA]})
@@ -74,6 +128,10 @@ SERVICE_HANDLE_EVENT_SCHEMA = vol.Schema(
     extra=vol.ALLOW_EXTRA,
     required=True)
 
+DIAGNOSTICS_INTERVAL = datetime.timedelta(seconds=60)
+STORAGE_SAVE_DELAY = 10
+RESTORED_TIMER_MIN_DELAY = datetime.timedelta(seconds=1)
+
 controllers = dict()
 
 _LOGGER = logging.getLogger(__name__)
@@ -82,18 +140,83 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup(hass, config):
     """Set up the complex_controller integration."""
     # try/catch?
-    for name, controller_config in config[DOMAIN].items():
-        controllers[name] = await ComplexController.create(
-            hass, name, controller_config)
+    start = time.perf_counter()
+    scheduler = DeadlineScheduler(hass, _LOGGER.getChild('scheduler'))
+    coalescer = ActionCoalescer(hass, _LOGGER.getChild('coalescer'))
+    store = ControllerStore(hass)
+    await store.async_load()
+    _LOGGER.debug(f'Loaded stored state in {time.perf_counter() - start:.3f}s')
+
+    start = time.perf_counter()
+    timer_names = [
+        SplitId(controller_config[CONF_TIMER]).name
+        for controller_config in config[DOMAIN].values()
+        if CONF_TIMER in controller_config
+    ]
+    if len(timer_names) > 0:
+        assert await async_setup_component(
+            hass, 'timer', {'timer': {name: {}
+                                      for name in timer_names}})
+        _LOGGER.debug(f'Set up {len(timer_names)} timer entities in '
+                      f'{time.perf_counter() - start:.3f}s')
+
+    start = time.perf_counter()
+    names = list(config[DOMAIN])
+    created = await asyncio.gather(
+        *(ComplexController.create(hass, name, config[DOMAIN][name],
+                                   scheduler, store, coalescer)
+          for name in names))
+    controllers.update(zip(names, created))
+    _LOGGER.info(f'Created {len(names)} controllers in '
+                 f'{time.perf_counter() - start:.3f}s')
 
     hass.services.async_register(DOMAIN,
                                  SERVICE_HANDLE_EVENT,
                                  async_on_handle_event,
                                  schema=SERVICE_HANDLE_EVENT_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_STATS,
+                                 async_on_dump_stats)
+    hass.services.async_register(
+        DOMAIN, SERVICE_RELOAD,
+        functools.partial(async_on_reload, hass, scheduler, store, coalescer))
 
     return True
 
 
+async def async_on_reload(hass, scheduler, store, coalescer, event):
+    """Rebuild only the controllers whose config changed."""
+    config = await async_integration_yaml_config(hass, DOMAIN)
+    if config is None:
+        return
+    new_configs = config.get(DOMAIN, dict())
+    for name in list(controllers):
+        if name not in new_configs:
+            _LOGGER.info(f'Removing controller {name}')
+            controllers.pop(name).stop()
+            hass.states.async_remove(f'{DOMAIN}.{name}')
+    for name, controller_config in new_configs.items():
+        controller = controllers.get(name)
+        if controller is not None and controller.config == controller_config:
+            continue
+        if controller is not None and is_only_tree_changed(
+                controller.config, controller_config):
+            _LOGGER.info(f'Rebuilding tree of controller {name}')
+            await controller.async_rebuild_tree(controller_config)
+            continue
+        if controller is not None:
+            # State and timer deadline are carried over through the store.
+            controller.stop()
+        _LOGGER.info(f'Creating controller {name}')
+        controllers[name] = await ComplexController.create(
+            hass, name, controller_config, scheduler, store, coalescer)
+
+
+def is_only_tree_changed(old_config, new_config):
+    return all(old_config.get(key) == new_config.get(key)
+               for key in set(old_config) | set(new_config)
+               if key != CONF_BASE)
+
+
 #@homeassistant.core.callback
 async def async_on_handle_event(event):
     controller_name = event.data[ATTR_CONTROLLER]
@@ -103,50 +226,239 @@ async def async_on_handle_event(event):
             f'Got service {SERVICE_HANDLE_EVENT} call with {ATTR_CONTROLLER} = {controller_name} which is not set up!'
         )
         return
-    if not await controller.dispatcher_tree.async_dispatch(event):
-        _LOGGER.debug(
-            f'Event was not dispatched by {controller_name}: {event}')
+    await controller.async_handle_event(event)
+
+
+async def async_on_dump_stats(event):
+    for name, controller in controllers.items():
+        _LOGGER.info(f'Diagnostics of {name}: {controller.get_diagnostics()}')
 
 
 class ComplexController(object):
     @staticmethod
-    async def create(hass, name, config):
+    async def create(hass, name, config, scheduler, store, coalescer):
         new_controller = ComplexController()
         new_controller.hass = hass
+        new_controller.name = name
+        new_controller.config = config
+        new_controller.remove_listeners = list()
+        new_controller.recent_events = dict()
+        start = time.perf_counter()
         logger = _LOGGER.getChild(name)
+        new_controller.logger = logger
         entity_id = f'{DOMAIN}.{name}'
-        timer_helper = await HassTimerHelper.create(
-            hass, config.get(CONF_TIMER, f'timer.{entity_id}'), name,
-            logger.getChild('timer_helper'))
-        tree_context = TreeContext(hass, entity_id, timer_helper)
-        await tree_context.state_controller.async_set(DEFAULT_STATE)
-        new_controller.dispatcher_tree = await DispatcherTreeNode.create(
+        timer_entity_id = config.get(CONF_TIMER)
+        if timer_entity_id is not None and hass.states.get(
+                timer_entity_id) is None:
+            # Timer entities are only set up on start, not on reload.
+            logger.warning(f'Timer {timer_entity_id} does not exist, '
+                           'using a local timer until restart')
+            timer_entity_id = None
+        if timer_entity_id is not None:
+            timer_helper = await HassTimerHelper.create(
+                hass, timer_entity_id, name, logger.getChild('timer_helper'))
+        else:
+            timer_helper = LocalTimerHelper(hass, scheduler, name,
+                                            logger.getChild('timer_helper'))
+        tree_context = TreeContext(hass, entity_id, timer_helper,
+                                   config[CONF_CACHE_CONDITIONS],
+                                   config[CONF_TRANSITION_ATTRIBUTES],
+                                   config[CONF_DIAGNOSTICS])
+        new_controller.tree_context = tree_context
+        if config[CONF_COALESCE_WINDOW] > 0:
+            tree_context.call_service = functools.partial(
+                coalescer.async_call,
+                priority=config[CONF_PRIORITY],
+                window=config[CONF_COALESCE_WINDOW])
+        new_controller.stats = tree_context.make_stats()
+        timer_helper.stats = new_controller.stats
+        stored = store.get(name)
+        await tree_context.state_controller.async_set(
+            stored.get('state', DEFAULT_STATE))
+        tree_context.state_controller.persist = functools.partial(
+            store.update, name)
+        timer_helper.persist = functools.partial(store.update, name)
+        new_controller.root_node = await DispatcherTreeNode.create(
             config[CONF_BASE], tree_context, logger)
+        new_controller.compile_tree()
+        await new_controller.async_restore_timer(stored.get('deadline'))
+        for trigger_config in config.get(CONF_TRIGGERS, []):
+            new_controller.add_trigger(trigger_config)
+        if new_controller.stats is not None:
+            new_controller.remove_listeners.append(
+                async_track_time_interval(
+                    hass, new_controller.update_diagnostics_sensor,
+                    DIAGNOSTICS_INTERVAL))
+        logger.debug(f'Created in {time.perf_counter() - start:.3f}s')
         return new_controller
 
+    def compile_tree(self):
+        self.dispatcher_tree = self.root_node
+        if self.config[CONF_DISPATCH_MODE] == DISPATCH_MODE_COMPILED:
+            self.dispatcher_tree = CompiledDispatchTable(
+                self.root_node, self.logger.getChild('compiled'))
+
+    async def async_rebuild_tree(self, config):
+        """Replace changed subtrees, keeping state and the running timer."""
+        old_nodes = set(self.root_node.walk())
+        self.root_node = await DispatcherTreeNode.async_rebuild(
+            config[CONF_BASE], self.root_node, self.tree_context, self.logger)
+        self.config = config
+        self.compile_tree()
+        new_nodes = set(self.root_node.walk())
+        for node in old_nodes - new_nodes:
+            node.stop()
+        timer = self.tree_context.timer
+        if timer.enrollee is not None and timer.enrollee not in set(
+                node.dispatcher for node in new_nodes):
+            timer.enrollee = self.dispatcher_tree
+
+    def stop(self):
+        for remove_listener in self.remove_listeners:
+            remove_listener()
+        self.remove_listeners = list()
+        for node in self.root_node.walk():
+            node.stop()
+        self.tree_context.timer.stop()
+
+    async def async_restore_timer(self, deadline):
+        """Re-arm a timer that was running before restart without issuing
+        any actions; an expired one fires right away."""
+        if deadline is None:
+            return
+        deadline = dt_util.parse_datetime(deadline)
+        if deadline is None:
+            return
+        delay = max(deadline - dt_util.utcnow(), RESTORED_TIMER_MIN_DELAY)
+        self.logger.debug(f'Restoring timer with {delay} left.')
+        # The node that armed the timer is unknown after restart, so the
+        # timer event goes through the tree like any other event.
+        await self.tree_context.timer.async_schedule(delay,
+                                                     self.dispatcher_tree)
+
+    def add_trigger(self, trigger_config):
+        """Bind sensor state changes directly to this controller."""
+        to_state = trigger_config.get(CONF_TO)
+        event = homeassistant.core.Event(SERVICE_HANDLE_EVENT, {
+            ATTR_CONTROLLER: self.name,
+            ATTR_EVENT_TYPE: trigger_config[ATTR_EVENT_TYPE]
+        })
 
-class DispatcherTreeNode(object):
-    @staticmethod
-    async def create(config, tree_context, logger):
-        new_obj = DispatcherTreeNode()
+        @homeassistant.core.callback
+        def on_state_changed(state_event):
+            old_state = state_event.data.get('old_state')
+            new_state = state_event.data.get('new_state')
+            if new_state is None:
+                return
+            if old_state is not None and old_state.state == new_state.state:
+                return
+            if to_state is not None and new_state.state != to_state:
+                return
+            self.hass.async_create_task(self.async_handle_event(event))
+
+        self.remove_listeners.append(
+            async_track_state_change_event(self.hass,
+                                           trigger_config[CONF_ENTITY_ID],
+                                           on_state_changed))
+
+    async def async_handle_event(self, event):
+        """Identical events arriving within event_window of the last one
+        dispatched are dropped as long as the state has not changed since."""
+        window = self.config[CONF_EVENT_WINDOW]
+        if window == 0:
+            await self.async_dispatch_event(event)
+            return
+        key = make_hashable(event.data)
+        now = self.hass.loop.time()
+        state_controller = self.tree_context.state_controller
+        recent = self.recent_events.get(key)
+        if recent is not None and now - recent[0] < window and recent[
+                1] == state_controller.state:
+            if self.stats is not None:
+                self.stats.increment('events_coalesced')
+            self.logger.debug(f'Coalesced repeated event: {event}')
+            return
+        await self.async_dispatch_event(event)
+        self.recent_events[key] = (now, state_controller.state)
+
+    async def async_dispatch_event(self, event):
+        if self.stats is None:
+            if not await self.dispatcher_tree.async_dispatch(event):
+                self.logger.debug(f'Event was not dispatched: {event}')
+            return
+        self.stats.increment('events_received')
+        start = time.perf_counter()
+        dispatched = await self.dispatcher_tree.async_dispatch(event)
+        self.stats.record('dispatch_time', time.perf_counter() - start)
+        if dispatched:
+            self.stats.increment('events_dispatched')
+        else:
+            self.stats.increment('events_dropped')
+            self.logger.debug(f'Event was not dispatched: {event}')
+
+    def get_diagnostics(self):
+        return {
+            'controller': self.stats.as_dict() if self.stats else None,
+            'state_writes_suppressed':
+            self.tree_context.state_controller.suppressed_writes,
+            'timer_saved_calls': self.tree_context.timer.saved_calls,
+            'nodes': {
+                node.path: node.get_diagnostics()
+                for node in self.root_node.walk()
+            }
+        }
 
-        async def get_condition_from_config(condition_config):
-            return await homeassistant.helpers.condition.async_from_config(
-                tree_context.hass, condition_config, config_validation=False)
+    @homeassistant.core.callback
+    def update_diagnostics_sensor(self, now=None):
+        self.hass.states.async_set(
+            f'sensor.{DOMAIN}_{self.name}_diagnostics',
+            self.stats.counters['events_received'], self.get_diagnostics())
 
-        condition_config = config.get(CONF_CONDITION)
-        new_obj._condition = await get_condition_from_config(
-            condition_config
-        ) if condition_config is not None else lambda hass: True
 
+class DispatcherTreeNode(object):
+    __slots__ = ('config', 'path', 'stats', 'tree_context', 'logger',
+                 'condition_config', '_condition', '_condition_lock',
+                 'dispatcher', 'children')
+
+    @staticmethod
+    async def async_rebuild(config,
+                            old_node,
+                            tree_context,
+                            logger,
+                            path=CONF_BASE):
+        """Reuse old_node if its config is unchanged, otherwise create a new
+        node that in turn reuses unchanged child subtrees."""
+        if old_node is not None and old_node.config == config:
+            return old_node
+        return await DispatcherTreeNode.create(config, tree_context, logger,
+                                               path, old_node)
+
+    @staticmethod
+    async def create(config,
+                     tree_context,
+                     logger,
+                     path=CONF_BASE,
+                     old_node=None):
+        new_obj = DispatcherTreeNode()
+        new_obj.config = config
+        new_obj.path = path
+        new_obj.stats = tree_context.make_stats()
         new_obj.tree_context = tree_context
         new_obj.logger = logger
 
+        # Override conditions are compiled on first use.
+        new_obj.condition_config = config.get(CONF_CONDITION)
+        new_obj._condition = None
+        new_obj._condition_lock = None
+        if path == CONF_BASE:
+            await new_obj.async_ensure_condition()
+
         dispather_type = config[CONF_TYPE]
         new_obj.dispatcher = Dispatcher(
             tree_context,
             ActionController(tree_context.hass, config,
-                             logger.getChild('Action')),
+                             logger.getChild('Action'), new_obj.stats,
+                             tree_context.call_service),
             logger.getChild(dispather_type))
         if dispather_type == CONF_DISPATCHER_DIM:
             make_dim_dispatcher(new_obj.dispatcher, config)
@@ -159,30 +471,308 @@ class DispatcherTreeNode(object):
         else:
             raise (BaseException(
                 'Unknown dispatcher type: {}'.format(dispather_type)))
+        new_obj.dispatcher.compile()
 
         new_obj.children = list()
+        old_children = old_node.children if old_node is not None else []
         for i, child in enumerate(config.get(CONF_OVERRIDES, [])):
-            new_obj.children.append(await DispatcherTreeNode.create(
-                child, tree_context, logger.getChild(f'{i}')))
+            old_child = old_children[i] if i < len(old_children) else None
+            new_obj.children.append(await DispatcherTreeNode.async_rebuild(
+                child, old_child, tree_context, logger.getChild(f'{i}'),
+                f'{path}.{i}'))
         return new_obj
 
+    def stop(self):
+        if isinstance(self._condition, ConditionCache):
+            self._condition.stop()
+        self.dispatcher.scene_controller.stop()
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    async def async_ensure_condition(self):
+        if self._condition is not None:
+            return
+        if self.condition_config is None:
+            self._condition = lambda hass: True
+            return
+        # Concurrent events wait for the first compilation instead of
+        # compiling again and leaking the listeners of the first cache.
+        if self._condition_lock is None:
+            self._condition_lock = asyncio.Lock()
+        async with self._condition_lock:
+            if self._condition is None:
+                self._condition = await self._async_compile_condition()
+        self._condition_lock = None
+
+    async def _async_compile_condition(self):
+        hass = self.tree_context.hass
+        # Compiling attaches hass to the templates, which would make the
+        # stored config compare unequal on reload.
+        condition_config = copy_templates(self.condition_config)
+        if self.tree_context.cache_conditions:
+            return await ConditionCache.create(
+                hass, condition_config,
+                self.logger.getChild('condition_cache'))
+        return await homeassistant.helpers.condition.async_from_config(
+            hass, condition_config, config_validation=False)
+
+    async def async_check_condition(self):
+        await self.async_ensure_condition()
+        return self.check_condition()
+
     def check_condition(self):
-        return self._condition(self.tree_context.hass)
+        if self.stats is None:
+            return self._condition(self.tree_context.hass)
+        start = time.perf_counter()
+        result = self._condition(self.tree_context.hass)
+        self.stats.record('condition_time', time.perf_counter() - start)
+        return result
+
+    async def async_dispatch_here(self, event):
+        self.logger.debug('I dispatch the event.')
+        if self.stats is not None:
+            self.stats.increment('events_dispatched')
+        await self.dispatcher.async_dispatch(event)
+
+    def get_diagnostics(self):
+        diagnostics = self.stats.as_dict() if self.stats else dict()
+        if isinstance(self._condition, ConditionCache):
+            diagnostics['condition_cache_hits'] = self._condition.hits
+            diagnostics['condition_cache_misses'] = self._condition.misses
+        diagnostics.update(self.dispatcher.scene_controller.get_diagnostics())
+        return diagnostics
 
     async def async_dispatch(self, event):
-        if self.check_condition():
+        if await self.async_check_condition():
             if not any(await asyncio.gather(*(child.async_dispatch(event)
                                               for child in self.children))):
                 if len(self.children) > 0:
                     self.logger.debug('No children could dispatch event.')
-                self.logger.debug('I dispatch the event.')
-                await self.dispatcher.async_dispatch(event)
+                await self.async_dispatch_here(event)
             return True
         self.logger.debug('My condition does not match the event.')
         return False
 
 
-class HassTimerHelper(object):
+class ControllerStore(object):
+    """Controller states and timer deadlines, saved with a delay so that
+    bursts of transitions end up in one write."""
+    def __init__(self, hass):
+        self.store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self.data = dict()
+
+    async def async_load(self):
+        self.data = await self.store.async_load() or dict()
+
+    def get(self, name):
+        return self.data.get(name, dict())
+
+    def update(self, name, **values):
+        self.data.setdefault(name, dict()).update(values)
+        self.store.async_delay_save(lambda: self.data, STORAGE_SAVE_DELAY)
+
+
+class CompiledDispatchTable(object):
+    """Override tree flattened in pre-order; the first matching branch wins."""
+    class Entry(object):
+        __slots__ = ('node', 'has_children', 'subtree_end', 'parent_end')
+
+        def __init__(self, node, has_children):
+            self.node = node
+            self.has_children = has_children
+            self.subtree_end = None
+            self.parent_end = None
+
+    def __init__(self, root, logger):
+        self.logger = logger
+        self.entries = list()
+        root_entry = self._flatten(root)
+        root_entry.parent_end = len(self.entries)
+        self.logger.debug(
+            f'Compiled {len(self.entries)} tree nodes into a dispatch table.')
+
+    def _flatten(self, node):
+        entry = CompiledDispatchTable.Entry(node, len(node.children) > 0)
+        self.entries.append(entry)
+        child_entries = [self._flatten(child) for child in node.children]
+        entry.subtree_end = len(self.entries)
+        for child_entry in child_entries:
+            child_entry.parent_end = entry.subtree_end
+        return entry
+
+    async def async_find_dispatcher_node(self):
+        matched = None
+        i = 0
+        while i < len(self.entries):
+            entry = self.entries[i]
+            if await entry.node.async_check_condition():
+                matched = entry
+                if not entry.has_children:
+                    break
+                i += 1
+            else:
+                i = entry.subtree_end
+                if i >= entry.parent_end:
+                    break
+        return matched.node if matched is not None else None
+
+    async def async_dispatch(self, event):
+        node = await self.async_find_dispatcher_node()
+        if node is None:
+            self.logger.debug('No node condition matches the event.')
+            return False
+        await node.async_dispatch_here(event)
+        return True
+
+
+class ActionCoalescer(object):
+    """Collects service calls from all controllers for a short window, merges
+    identical ones and lets the highest priority call win per entity."""
+    def __init__(self, hass, logger):
+        self.hass = hass
+        self.logger = logger
+        self.targets = dict()
+        self.untargeted_calls = dict()
+        self.flushed = None
+
+    async def async_call(self, domain, service, service_data, priority,
+                         window):
+        entity_ids = service_data.get(ATTR_ENTITY_ID)
+        if entity_ids is None:
+            key = (domain, service, make_hashable(service_data))
+            self.untargeted_calls[key] = service_data
+        else:
+            if isinstance(entity_ids, str):
+                entity_ids = [entity_ids]
+            data = dict(service_data)
+            del data[ATTR_ENTITY_ID]
+            call = (priority, domain, service, data)
+            for entity_id in entity_ids:
+                current_call = self.targets.get(entity_id)
+                if current_call is not None and current_call[0] > priority:
+                    continue
+                if current_call is not None and current_call[1:] != call[1:]:
+                    self.logger.debug(f'Conflicting calls for {entity_id}: '
+                                      f'{current_call} replaced by {call}')
+                self.targets[entity_id] = call
+        if self.flushed is None:
+            self.flushed = self.hass.loop.create_future()
+            self.hass.loop.call_later(window, self._on_window_closed)
+        await asyncio.shield(self.flushed)
+
+    @homeassistant.core.callback
+    def _on_window_closed(self):
+        groups = dict()
+        for entity_id, (_, domain, service, data) in self.targets.items():
+            key = (domain, service, make_hashable(data))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (domain, service, data, [])
+            group[3].append(entity_id)
+        calls = [(domain, service, {
+            **data, ATTR_ENTITY_ID: entity_ids
+        }) for domain, service, data, entity_ids in groups.values()]
+        for key, service_data in self.untargeted_calls.items():
+            calls.append((key[0], key[1], service_data))
+        flushed = self.flushed
+        self.targets = dict()
+        self.untargeted_calls = dict()
+        self.flushed = None
+        self.hass.async_create_task(self._async_call_all(calls, flushed))
+
+    async def _async_call_all(self, calls, flushed):
+        self.logger.debug(f'Issuing {len(calls)} coalesced service calls.')
+        try:
+            await asyncio.gather(
+                *(self.hass.services.async_call(domain, service, data)
+                  for domain, service, data in calls))
+        finally:
+            flushed.set_result(None)
+
+
+class TimerHelperBase(object):
+    """Tracks whether the timer is armed so that redundant cancels are
+    skipped and a cancel followed by a start becomes one restart."""
+    def __init__(self):
+        self.enrollee = None
+        self.detached_enrollee = None
+        self.armed = False
+        self.cancel_deferred = False
+        self.saved_calls = 0
+        self.stats = None
+        self.persist = None
+
+    async def async_schedule(self, delay, enrollee: 'Dispatcher'):
+        if self.cancel_deferred:
+            self.cancel_deferred = False
+            self.saved_calls += 1
+        self.enrollee = enrollee
+        start = time.perf_counter()
+        await self._async_start(delay)
+        self.armed = True
+        self._persist_deadline((dt_util.utcnow() + delay).isoformat())
+        if self.stats is not None:
+            self.stats.record('timer_call_time', time.perf_counter() - start)
+
+    async def async_cancel(self):
+        self.enrollee = None
+        self.cancel_deferred = False
+        if not self.armed:
+            self.saved_calls += 1
+            return
+        self.armed = False
+        self._persist_deadline(None)
+        start = time.perf_counter()
+        await self._async_stop()
+        if self.stats is not None:
+            self.stats.record('timer_call_time', time.perf_counter() - start)
+
+    def defer_cancel(self):
+        """Detach the enrollee now and cancel in async_flush_cancel() unless
+        the timer gets rescheduled in between."""
+        self.detached_enrollee = self.enrollee
+        self.enrollee = None
+        self.cancel_deferred = True
+
+    async def async_flush_cancel(self):
+        self.detached_enrollee = None
+        if self.cancel_deferred:
+            await self.async_cancel()
+
+    def restore_deferred(self):
+        """Undo defer_cancel() if a handler failed before flushing, leaving
+        a still armed timer to its enrollee."""
+        if self.cancel_deferred and self.armed:
+            self.enrollee = self.detached_enrollee
+        self.detached_enrollee = None
+        self.cancel_deferred = False
+
+    def pop_enrollee(self):
+        self.armed = False
+        self._persist_deadline(None)
+        current_enrollee = self.enrollee
+        self.enrollee = None
+        return current_enrollee
+
+    def stop(self):
+        """Detach from the timer without touching the persisted deadline."""
+        raise NotImplementedError()
+
+    def _persist_deadline(self, deadline):
+        if self.persist is not None:
+            self.persist(deadline=deadline)
+
+    async def _async_start(self, delay):
+        raise NotImplementedError()
+
+    async def _async_stop(self):
+        raise NotImplementedError()
+
+
+class HassTimerHelper(TimerHelperBase):
     @staticmethod
     async def create(hass, entity_id, controller_name, logger):
         new_obj = HassTimerHelper()
@@ -190,12 +780,7 @@ class HassTimerHelper(object):
         new_obj.entity_id = SplitId(entity_id)
         new_obj.controller_name = controller_name
         new_obj.logger = logger
-        new_obj.enrollee = None
 
-        assert await async_setup_component(
-            hass, 'timer', {'timer': {
-                new_obj.entity_id.name: {}
-            }})
         new_obj.remove_listener = hass.bus.async_listen(
             'timer.finished', new_obj.on_timer_finished)
         return new_obj
@@ -203,32 +788,369 @@ class HassTimerHelper(object):
     def __del__(self):
         self.remove_listener()
 
-    async def async_schedule(self, delay, enrollee: 'Dispatcher'):
-        self.enrollee = enrollee
+    def stop(self):
+        self.remove_listener()
+        self.remove_listener = lambda: None
+
+    async def _async_start(self, delay):
+        # timer.start on an active timer restarts it with the new duration.
         await self.hass.services.async_call('timer', 'start', {
             ATTR_ENTITY_ID: self.entity_id.full,
             'duration': str(delay)
         })
 
-    async def async_cancel(self):
+    async def _async_stop(self):
         await self.hass.services.async_call(
             'timer', 'cancel', {ATTR_ENTITY_ID: self.entity_id.full})
-        self.enrollee = None
 
     async def on_timer_finished(self, event):
         if event.data[ATTR_ENTITY_ID] == self.entity_id.full:
-            if self.enrollee is None:
-                self.logger.error(
-                    'Got a timer finished event, but have no enrollee!')
+            current_enrollee = self.pop_enrollee()
+            if current_enrollee is None:
+                self.logger.debug(
+                    'Got a timer finished event, but have no enrollee.')
                 return
-            event = homeassistant.core.Event(
-                SERVICE_HANDLE_EVENT, {
-                    ATTR_CONTROLLER: self.controller_name,
-                    ATTR_EVENT_TYPE: EVENT_TYPE_TIMER
-                })
-            current_enrollee = self.enrollee
-            self.enrollee = None
-            await current_enrollee.async_dispatch(event)
+            await current_enrollee.async_dispatch(
+                make_timer_event(self.controller_name))
+
+
+class DeadlineScheduler(object):
+    """One heap of deadlines for all controllers, driven by loop.call_at."""
+    def __init__(self, hass, logger):
+        self.hass = hass
+        self.logger = logger
+        self.heap = list()
+        self.sequence = itertools.count()
+        self.handle = None
+        self.handle_deadline = None
+
+    def schedule(self, delay, callback):
+        """Returns a token that must be passed to cancel()."""
+        deadline = self.hass.loop.time() + delay.total_seconds()
+        token = [deadline, next(self.sequence), callback]
+        heapq.heappush(self.heap, token)
+        self._arm()
+        return token
+
+    def cancel(self, token):
+        # Lazy deletion: the entry is skipped when it reaches the heap top.
+        token[2] = None
+
+    def _arm(self):
+        while len(self.heap) > 0 and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        if len(self.heap) == 0:
+            deadline = None
+        else:
+            deadline = self.heap[0][0]
+        if deadline == self.handle_deadline:
+            return
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.handle_deadline = deadline
+        if deadline is not None:
+            self.handle = self.hass.loop.call_at(deadline, self._on_deadline)
+
+    def _on_deadline(self):
+        self.handle = None
+        self.handle_deadline = None
+        now = self.hass.loop.time()
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            _, _, callback = heapq.heappop(self.heap)
+            if callback is not None:
+                callback()
+        self._arm()
+
+
+class LocalTimerHelper(TimerHelperBase):
+    def __init__(self, hass, scheduler, controller_name, logger):
+        TimerHelperBase.__init__(self)
+        self.hass = hass
+        self.scheduler = scheduler
+        self.controller_name = controller_name
+        self.logger = logger
+        self.token = None
+
+    async def _async_start(self, delay):
+        self._cancel_token()
+        self.token = self.scheduler.schedule(delay, self.on_deadline)
+
+    async def _async_stop(self):
+        self._cancel_token()
+
+    def stop(self):
+        self._cancel_token()
+
+    def _cancel_token(self):
+        if self.token is not None:
+            self.scheduler.cancel(self.token)
+            self.token = None
+
+    @homeassistant.core.callback
+    def on_deadline(self):
+        self.token = None
+        current_enrollee = self.pop_enrollee()
+        if current_enrollee is None:
+            self.logger.debug('Got a deadline, but have no enrollee.')
+            return
+        self.hass.async_create_task(
+            current_enrollee.async_dispatch(
+                make_timer_event(self.controller_name)))
+
+
+def make_timer_event(controller_name):
+    return homeassistant.core.Event(SERVICE_HANDLE_EVENT, {
+        ATTR_CONTROLLER: controller_name,
+        ATTR_EVENT_TYPE: EVENT_TYPE_TIMER
+    })
+
+
+class EntityDependentCache(object):
+    """Result that stays valid until one of the tracked entities changes."""
+    def __init__(self, hass):
+        self.hass = hass
+        self.hits = 0
+        self.misses = 0
+        self.result = None
+        self.valid = False
+        self.tracked_entities = frozenset()
+        self.remove_listener = None
+
+    def track_entities(self, entities):
+        entities = frozenset(entities)
+        if entities != self.tracked_entities:
+            self.stop()
+            if len(entities) > 0:
+                self.remove_listener = async_track_state_change_event(
+                    self.hass, list(entities), self.on_state_changed)
+            self.tracked_entities = entities
+
+    @staticmethod
+    def is_trackable(template, render_info):
+        return not (render_info.all_states or render_info.domains
+                    or getattr(render_info, 'has_time', False)
+                    or 'now()' in template.template)
+
+    @homeassistant.core.callback
+    def on_state_changed(self, event):
+        self.valid = False
+
+    def stop(self):
+        if self.remove_listener is not None:
+            self.remove_listener()
+            self.remove_listener = None
+        self.tracked_entities = frozenset()
+
+
+class ConditionCache(EntityDependentCache):
+    """Condition result that stays valid until a referenced entity changes
+    or the next time condition boundary passes.
+
+    Template conditions, and the and/or/not conditions around them, are
+    checked here rather than by Home Assistant, so that the render info of
+    the one render that decided the result also tells what to track."""
+    UNCACHEABLE_CONDITIONS = ('sun', 'device', 'trigger')
+    LOGICAL_CONDITIONS = {'and': all, 'or': any, 'not': lambda r: not any(r)}
+
+    def __init__(self, hass, condition_config, logger):
+        EntityDependentCache.__init__(self, hass)
+        self.condition = None
+        self.logger = logger
+
+        self.cacheable = True
+        self.entities = set()
+        self.times = list()
+        self.render_infos = list()
+        self._collect(condition_config)
+
+        self.valid_until = None
+        if not self.cacheable:
+            self.logger.debug('Condition can not be cached.')
+
+    @staticmethod
+    async def create(hass, condition_config, logger):
+        new_obj = ConditionCache(hass, condition_config, logger)
+        new_obj.condition = await new_obj._async_compile(condition_config)
+        return new_obj
+
+    async def _async_compile(self, config):
+        if not ConditionCache.has_template(config):
+            return await homeassistant.helpers.condition.async_from_config(
+                self.hass, config, config_validation=False)
+        condition_type = config[CONF_CONDITION]
+        if condition_type == 'template':
+            template = config['value_template']
+            template_helper.attach(self.hass, template)
+            return functools.partial(self._check_template, template)
+        checks = [
+            await self._async_compile(nested_config)
+            for nested_config in config['conditions']
+        ]
+        combine = ConditionCache.LOGICAL_CONDITIONS[condition_type]
+        return lambda hass, variables=None: combine(
+            check(hass, variables) for check in checks)
+
+    @staticmethod
+    def has_template(config):
+        condition_type = config.get(CONF_CONDITION)
+        if condition_type == 'template':
+            return True
+        return condition_type in ConditionCache.LOGICAL_CONDITIONS and any(
+            ConditionCache.has_template(nested_config)
+            for nested_config in config.get('conditions', []))
+
+    def _check_template(self, template, hass, variables=None):
+        render_info = template.async_render_to_info(variables)
+        self.render_infos.append((template, render_info))
+        try:
+            value = render_info.result()
+        except TemplateError as error:
+            self.logger.warning(f'Error in condition template: {error}')
+            return False
+        return str(value).strip().lower() == 'true'
+
+    def _collect(self, config):
+        condition_type = config.get(CONF_CONDITION)
+        if condition_type in ConditionCache.UNCACHEABLE_CONDITIONS:
+            self.cacheable = False
+        if condition_type == 'state' and config.get('for') is not None:
+            self.cacheable = False
+        if condition_type == 'numeric_state' and config.get(
+                'value_template') is not None:
+            self.cacheable = False
+        if condition_type == 'numeric_state':
+            # The bounds may be taken from an input_number, number or sensor.
+            for key in ('above', 'below'):
+                if isinstance(config.get(key), str):
+                    self.entities.add(config[key])
+        if condition_type == 'time':
+            for key in ('after', 'before'):
+                value = config.get(key)
+                if isinstance(value, str):
+                    # The boundary moves with an input_datetime or timestamp
+                    # sensor, not only when the entity changes.
+                    self.cacheable = False
+                elif value is not None:
+                    self.times.append(value)
+            if config.get('weekday') is not None:
+                self.times.append(datetime.time())
+
+        for key in (CONF_ENTITY_ID, 'zone'):
+            entity_ids = config.get(key, [])
+            if isinstance(entity_ids, str):
+                entity_ids = [entity_ids]
+            self.entities.update(entity_ids)
+
+        for nested_config in config.get('conditions', []):
+            self._collect(nested_config)
+
+    def __call__(self, hass):
+        if self.valid and (self.valid_until is None
+                           or dt_util.utcnow() < self.valid_until):
+            self.hits += 1
+            return self.result
+        self.misses += 1
+        self.render_infos = list()
+        self.result = self.condition(hass)
+        if self.cacheable:
+            self.valid = self._track_dependencies()
+            self.valid_until = self._get_next_time_boundary()
+        self.logger.debug(f'Condition evaluated to {self.result} '
+                          f'(hits={self.hits} misses={self.misses}).')
+        return self.result
+
+    def _track_dependencies(self):
+        # Templates skipped by and/or short-circuiting did not affect the
+        # result; the entities that made the check stop are tracked anyway.
+        entities = set(self.entities)
+        for template, render_info in self.render_infos:
+            if not self.is_trackable(template, render_info):
+                return False
+            entities.update(render_info.entities)
+        self.track_entities(entities)
+        return True
+
+    def _get_next_time_boundary(self):
+        if len(self.times) == 0:
+            return None
+        now = dt_util.now()
+        start_of_day = dt_util.start_of_local_day(now)
+        boundaries = list()
+        for time in self.times:
+            boundary = start_of_day + datetime.timedelta(
+                hours=time.hour, minutes=time.minute, seconds=time.second)
+            if boundary <= now:
+                boundary += datetime.timedelta(days=1)
+            boundaries.append(boundary)
+        return dt_util.as_utc(min(boundaries))
+
+
+class ServiceDataTemplate(EntityDependentCache):
+    """Service data with templates compiled once and rendered again only
+    after a referenced entity changes."""
+    def __init__(self, hass, service_data, logger):
+        EntityDependentCache.__init__(self, hass)
+        self.logger = logger
+        self.templates = list()
+        self.service_data = self._attach(service_data)
+
+    @staticmethod
+    def has_templates(value):
+        if isinstance(value, dict):
+            return any(
+                ServiceDataTemplate.has_templates(item)
+                for item in value.values())
+        if isinstance(value, list):
+            return any(
+                ServiceDataTemplate.has_templates(item) for item in value)
+        return isinstance(value, template_helper.Template)
+
+    def _attach(self, value):
+        if isinstance(value, dict):
+            return {key: self._attach(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._attach(item) for item in value]
+        if isinstance(value, template_helper.Template):
+            # A private copy keeps the config comparable on reload.
+            template = template_helper.Template(value.template, self.hass)
+            template.ensure_valid()
+            self.templates.append(template)
+            return template
+        return value
+
+    def render(self):
+        if self.valid:
+            self.hits += 1
+            return self.result
+        self.misses += 1
+        render_infos = list()
+        self.result = self._render(self.service_data, render_infos)
+        self.valid = all(
+            self.is_trackable(template, render_info)
+            for template, render_info in zip(self.templates, render_infos))
+        if self.valid:
+            self.track_entities(
+                itertools.chain.from_iterable(
+                    render_info.entities for render_info in render_infos))
+        else:
+            self.stop()
+        self.logger.debug(f'Rendered service data: {self.result}')
+        return self.result
+
+    def _render(self, value, render_infos):
+        if isinstance(value, dict):
+            return {
+                key: self._render(item, render_infos)
+                for key, item in value.items()
+            }
+        if isinstance(value, list):
+            return [self._render(item, render_infos) for item in value]
+        if isinstance(value, template_helper.Template):
+            render_info = value.async_render_to_info()
+            render_infos.append(render_info)
+            return render_info.result()
+        return value
 
 
 def get_event_type(event):
@@ -236,11 +1158,69 @@ def get_event_type(event):
 
 
 class TreeContext(object):
-    def __init__(self, hass, entity_id, timer):
+    def __init__(self,
+                 hass,
+                 entity_id,
+                 timer,
+                 cache_conditions=True,
+                 transition_attributes=False,
+                 diagnostics=False):
         self.hass = hass
-        self.entity_id = entity_id
+        self.entity_id = sys.intern(entity_id)
         self.timer = timer
-        self.state_controller = StateController(hass, entity_id)
+        self.cache_conditions = cache_conditions
+        self.diagnostics = diagnostics
+        self.call_service = hass.services.async_call
+        self.state_controller = StateController(hass, entity_id,
+                                                transition_attributes)
+
+    def make_stats(self):
+        return Stats() if self.diagnostics else None
+
+
+class Histogram(object):
+    BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self):
+        self.buckets = [0] * (len(Histogram.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(Histogram.BOUNDS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def as_dict(self):
+        labels = [f'<={bound}s' for bound in Histogram.BOUNDS]
+        labels.append(f'>{Histogram.BOUNDS[-1]}s')
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'buckets': dict(zip(labels, self.buckets))
+        }
+
+
+class Stats(object):
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+
+    def increment(self, name):
+        self.counters[name] += 1
+
+    def record(self, name, seconds):
+        self.histograms[name].record(seconds)
+
+    def as_dict(self):
+        result = dict(self.counters)
+        for name, histogram in self.histograms.items():
+            result[name] = histogram.as_dict()
+        return result
 
 
 class HandlerContext(object):
@@ -250,58 +1230,119 @@ class HandlerContext(object):
 
 
 class Dispatcher(object):
+    __slots__ = ('tree_context', 'scene_controller', 'logger', 'strategies',
+                 'transitions')
+
+    # Merged transition tables shared by all dispatchers with the same
+    # strategy types: (state, event_type) -> (strategy index, handler).
+    _transition_tables = dict()
+
     def __init__(self, tree_context, scene_controller, logger):
         self.tree_context = tree_context
         self.scene_controller = scene_controller
         self.logger = logger
         self.strategies = list()
+        self.transitions = types.MappingProxyType(dict())
 
     def add_strategy(self, strategy):
         self.strategies.append(strategy)
 
+    def compile(self):
+        """Merge strategies into one (state, event_type) -> handler table."""
+        self.strategies = tuple(self.strategies)
+        strategy_types = tuple(type(strategy) for strategy in self.strategies)
+        transitions = Dispatcher._transition_tables.get(strategy_types)
+        if transitions is not None:
+            self.transitions = transitions
+            return
+        transitions = dict()
+        for index, strategy_type in enumerate(strategy_types):
+            handler_map = strategy_type.get_handler_map()
+            for (state, event_type), handler in handler_map.items():
+                if state not in ALL_STATES or event_type not in ALL_EVENT_TYPES:
+                    raise vol.Invalid(
+                        f'{strategy_type.__name__} handles unknown '
+                        f'transition from {state} on {event_type}')
+                other = transitions.get((state, event_type))
+                if other is not None:
+                    raise vol.Invalid(
+                        f'Transition from {state} on {event_type} is handled '
+                        f'by both {other[1].__qualname__} and '
+                        f'{handler.__qualname__}')
+                transitions[state, event_type] = (index, handler)
+        self.transitions = types.MappingProxyType(transitions)
+        Dispatcher._transition_tables[strategy_types] = self.transitions
+        if len(transitions) == 0:
+            self.logger.debug('No transitions registered.')
+        for (state, event_type), (_, handler) in sorted(transitions.items()):
+            self.logger.debug(f'Transition {state} --{event_type}--> '
+                              f'{handler.__qualname__}')
+
     async def async_dispatch(self, event):
-        current_state = self.tree_context.state_controller.get(
-        ).state
+        current_state = self.tree_context.state_controller.state
         event_type = get_event_type(event)
-        for strategy in self.strategies:
-            handler = strategy.get_handler(current_state, event_type)
-            if handler is not None:
-                await self.tree_context.timer.async_cancel()
-                await handler(self, current_state, event)
-                return
+        transition = self.transitions.get((current_state, event_type))
+        if transition is not None:
+            index, handler = transition
+            timer = self.tree_context.timer
+            timer.defer_cancel()
+            try:
+                await handler(self.strategies[index], self, current_state,
+                              event)
+                await timer.async_flush_cancel()
+            finally:
+                timer.restore_deferred()
+            return
         self.logger.debug(
             'No handler registered for transition from {} on {}'.format(
                 current_state, get_event_type(event)))
 
 
 class HandlerStrategyBase(object):
-    def __init__(self):
-        self.handler_map = dict()
+    """Handlers are registered once per strategy type in register_handlers()
+    and shared by all instances."""
+    __slots__ = ()
+
+    _handler_maps = dict()
 
-    def set_handler(self, states, event_types, handler):
+    @classmethod
+    def register_handlers(cls):
+        pass
+
+    @classmethod
+    def set_handler(cls, states, event_types, handler):
         if not isinstance(states, list):
             states = [states]
         if not isinstance(event_types, list):
             event_types = [event_types]
+        handler_map = HandlerStrategyBase._handler_maps[cls]
         for state in states:
             for event_type in event_types:
-                self.handler_map[state, event_type] = handler
+                handler_map[state, event_type] = handler
 
-    def get_handler(self, state, event_type):
-        return self.handler_map.get((state, event_type))
+    @classmethod
+    def get_handler_map(cls):
+        handler_map = HandlerStrategyBase._handler_maps.get(cls)
+        if handler_map is None:
+            HandlerStrategyBase._handler_maps[cls] = dict()
+            cls.register_handlers()
+            handler_map = types.MappingProxyType(
+                HandlerStrategyBase._handler_maps[cls])
+            HandlerStrategyBase._handler_maps[cls] = handler_map
+        return handler_map
 
 
 class ManualHandlerStrategy(HandlerStrategyBase):
-    def __init__(self):
-        HandlerStrategyBase.__init__(self)
+    __slots__ = ()
 
-        self.set_handler([STATE_OFF, STATE_DIM], EVENT_TYPE_TOGGLE,
-                         self.async_turn_on)
-        self.set_handler([STATE_AUTO_ON, STATE_MANUAL_ON], EVENT_TYPE_TOGGLE,
-                         self.async_turn_off)
-        self.set_handler(ALL_STATES, EVENT_TYPE_MANUAL_ON, self.async_turn_on)
-        self.set_handler(ALL_STATES, EVENT_TYPE_MANUAL_OFF,
-                         self.async_turn_off)
+    @classmethod
+    def register_handlers(cls):
+        cls.set_handler([STATE_OFF, STATE_DIM], EVENT_TYPE_TOGGLE,
+                        cls.async_turn_on)
+        cls.set_handler([STATE_AUTO_ON, STATE_MANUAL_ON], EVENT_TYPE_TOGGLE,
+                        cls.async_turn_off)
+        cls.set_handler(ALL_STATES, EVENT_TYPE_MANUAL_ON, cls.async_turn_on)
+        cls.set_handler(ALL_STATES, EVENT_TYPE_MANUAL_OFF, cls.async_turn_off)
 
     async def async_turn_on(self, dispatcher, current_state, event):
         await dispatcher.scene_controller.async_turn_on()
@@ -314,14 +1355,18 @@ class ManualHandlerStrategy(HandlerStrategyBase):
 
 
 class SimpleMovementHandlerStrategy(HandlerStrategyBase):
+    __slots__ = ('duration_on', )
+
     def __init__(self, config):
-        HandlerStrategyBase.__init__(self)
         self.duration_on = config[CONF_DURATION_ON]
 
-        self.set_handler(AUTO_CHANGEABLE_STATES, EVENT_TYPE_MOVEMENT,
-                         self.async_turn_on)
-        self.set_handler(AUTO_CHANGEABLE_STATES, EVENT_TYPE_TIMER,
-                         self.async_turn_off)
+    @classmethod
+    def register_handlers(cls):
+        cls.set_handler(AUTO_CHANGEABLE_STATES, EVENT_TYPE_MOVEMENT,
+                        cls.async_turn_on)
+        cls.set_handler(STATE_AUTO_ON, EVENT_TYPE_MOVEMENT, cls.async_sustain)
+        cls.set_handler(AUTO_CHANGEABLE_STATES, EVENT_TYPE_TIMER,
+                        cls.async_turn_off)
 
     async def async_turn_on(self, dispatcher, current_state, event):
         await dispatcher.scene_controller.async_turn_on()
@@ -329,20 +1374,32 @@ class SimpleMovementHandlerStrategy(HandlerStrategyBase):
             self.duration_on, dispatcher)
         await dispatcher.tree_context.state_controller.async_set(STATE_AUTO_ON)
 
+    async def async_sustain(self, dispatcher, current_state, event):
+        """The lights are already on: only push the deadline further. If
+        another node armed the timer, its scene is replaced by ours."""
+        timer = dispatcher.tree_context.timer
+        if timer.detached_enrollee is not dispatcher:
+            await self.async_turn_on(dispatcher, current_state, event)
+            return
+        await timer.async_schedule(self.duration_on, dispatcher)
+
     async def async_turn_off(self, dispatcher, current_state, event):
         await dispatcher.scene_controller.async_turn_off()
         await dispatcher.tree_context.state_controller.async_set(STATE_OFF)
 
 
 class DimMovementHandlerStrategy(SimpleMovementHandlerStrategy):
+    __slots__ = ('duration_dim', )
+
     def __init__(self, config):
         SimpleMovementHandlerStrategy.__init__(self, config)
         self.duration_dim = config.get(CONF_DURATION_DIM, self.duration_on)
 
-        self.set_handler(AUTO_CHANGEABLE_STATES, EVENT_TYPE_MOVEMENT,
-                         self.async_turn_on)
-        self.set_handler(STATE_AUTO_ON, EVENT_TYPE_TIMER, self.async_turn_dim)
-        self.set_handler(STATE_DIM, EVENT_TYPE_TIMER, self.async_turn_off)
+    @classmethod
+    def register_handlers(cls):
+        super().register_handlers()
+        cls.set_handler(STATE_AUTO_ON, EVENT_TYPE_TIMER, cls.async_turn_dim)
+        cls.set_handler(STATE_DIM, EVENT_TYPE_TIMER, cls.async_turn_off)
 
     async def async_turn_dim(self, dispatcher, current_state, event):
         await dispatcher.scene_controller.async_turn_dim()
@@ -369,12 +1426,29 @@ def make_dim_dispatcher(dispatcher, config):
 
 
 class StateController(object):
-    def __init__(self, hass, entity_id):
+    """Publishes the controller state only when it actually changes."""
+    def __init__(self, hass, entity_id, transition_attributes=False):
         self.hass = hass
         self.entity_id = entity_id
+        self.transition_attributes = transition_attributes
+        self.state = None
+        self.suppressed_writes = 0
+        self.persist = None
 
     async def async_set(self, state):
-        self.hass.states.async_set(self.entity_id, state)
+        if state == self.state:
+            self.suppressed_writes += 1
+            return
+        attributes = None
+        if self.transition_attributes:
+            attributes = {
+                ATTR_PREVIOUS_STATE: self.state,
+                ATTR_LAST_TRANSITION: dt_util.utcnow().isoformat()
+            }
+        self.state = state
+        self.hass.states.async_set(self.entity_id, state, attributes)
+        if self.persist is not None:
+            self.persist(state=state)
 
     def get(self):
         return self.hass.states.get(self.entity_id)
@@ -382,28 +1456,50 @@ class StateController(object):
 
 class ActionController(object):
     class ServiceCaller(object):
-        def __init__(self, hass, config):
+        def __init__(self, hass, config, call_service, logger):
             self.hass = hass
+            self.call_service = call_service
+            self.logger = logger
             self.service = SplitId(config[CONF_SERVICE])
             self.service_data = config[CONF_SERVICE_DATA]
+            self.template = None
+            if ServiceDataTemplate.has_templates(self.service_data):
+                self.template = ServiceDataTemplate(
+                    hass, self.service_data, logger.getChild('template'))
 
         async def act(self):
-            await self.hass.services.async_call(self.service.domain,
-                                                self.service.name,
-                                                self.service_data)
+            service_data = self.service_data
+            if self.template is not None:
+                try:
+                    service_data = self.template.render()
+                except TemplateError as error:
+                    self.logger.error(
+                        f'Could not render service data for '
+                        f'{self.service.full}: {error}')
+                    return
+            await self.call_service(self.service.domain, self.service.name,
+                                    service_data)
+
+        def stop(self):
+            if self.template is not None:
+                self.template.stop()
 
     class SceneTurner(object):
-        def __init__(self, hass, config):
+        def __init__(self, hass, config, call_service):
             self.hass = hass
+            self.call_service = call_service
             self.scene = config[CONF_SCENE]
 
         async def act(self):
-            await self.hass.services.async_call('scene', 'turn_on',
-                                                {ATTR_ENTITY_ID: self.scene})
+            await self.call_service('scene', 'turn_on',
+                                    {ATTR_ENTITY_ID: self.scene})
 
-    def __init__(self, hass, config, logger):
+    def __init__(self, hass, config, logger, stats=None, call_service=None):
         self.hass = hass
         self.logger = logger
+        self.stats = stats
+        if call_service is None:
+            call_service = hass.services.async_call
 
         def get_actions(conf_key):
             action_configs = config.get(conf_key)
@@ -411,10 +1507,12 @@ class ActionController(object):
             for action_config in action_configs:
                 if check_schema(ACTION_SERVICE_SCHEMA, action_config):
                     actions.append(
-                        ActionController.ServiceCaller(hass, action_config))
+                        ActionController.ServiceCaller(
+                            hass, action_config, call_service, logger))
                 elif check_schema(ACTION_SCENE_SCHEMA, action_config):
                     actions.append(
-                        ActionController.SceneTurner(hass, action_config))
+                        ActionController.SceneTurner(
+                            hass, action_config, call_service))
                 else:
                     self.logger.error(
                         f'Cound not initialize action for {conf_key}.')
@@ -425,7 +1523,12 @@ class ActionController(object):
         self.actions_off = get_actions(CONF_ACTIONS_OFF)
 
     async def async_do_actions(self, actions):
+        if self.stats is None:
+            await asyncio.gather(*(action.act() for action in actions))
+            return
+        start = time.perf_counter()
         await asyncio.gather(*(action.act() for action in actions))
+        self.stats.record('action_time', time.perf_counter() - start)
 
     async def async_turn_on(self):
         await self.async_do_actions(self.actions_on)
@@ -436,6 +1539,30 @@ class ActionController(object):
     async def async_turn_off(self):
         await self.async_do_actions(self.actions_off)
 
+    def get_service_callers(self):
+        for action in itertools.chain(self.actions_on, self.actions_dim,
+                                      self.actions_off):
+            if isinstance(action, ActionController.ServiceCaller):
+                yield action
+
+    def get_diagnostics(self):
+        templates = [
+            caller.template for caller in self.get_service_callers()
+            if caller.template is not None
+        ]
+        if len(templates) == 0:
+            return dict()
+        return {
+            'template_cache_hits':
+            sum(template.hits for template in templates),
+            'template_cache_misses':
+            sum(template.misses for template in templates)
+        }
+
+    def stop(self):
+        for caller in self.get_service_callers():
+            caller.stop()
+
 
 def check_schema(schema, value):
     try:
@@ -444,8 +1571,34 @@ def check_schema(schema, value):
     except vol.Invalid:
         return False
 
+def make_hashable(value):
+    # Service call data arrives as a read-only mapping proxy.
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return tuple(
+            sorted((k, make_hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(make_hashable(v) for v in value)
+    return value
+
+
+def copy_templates(value):
+    """Copy of a config with fresh, unattached templates."""
+    if isinstance(value, dict):
+        return {key: copy_templates(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_templates(item) for item in value]
+    if isinstance(value, template_helper.Template):
+        return template_helper.Template(value.template)
+    return value
+
+
 class SplitId(object):
+    __slots__ = ('domain', 'name', 'full')
+
     def __init__(self, entity_id):
         assert (entity_id is not None)
-        self.domain, self.name = homeassistant.core.split_entity_id(entity_id)
+        entity_id = sys.intern(entity_id)
+        domain, name = homeassistant.core.split_entity_id(entity_id)
+        self.domain = sys.intern(domain)
+        self.name = sys.intern(name)
         self.full = entity_id
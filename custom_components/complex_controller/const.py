@@ -5,17 +5,26 @@ DOMAIN = 'complex_controller'
 CONF_ACTIONS_ON = 'action_on'
 CONF_ACTIONS_DIM = 'action_dim'
 CONF_ACTIONS_OFF = 'action_off'
+CONF_CACHE_CONDITIONS = 'cache_conditions'
+CONF_COALESCE_WINDOW = 'coalesce_window'
 CONF_DISPATCHER_DIM = 'dim'
 CONF_DISPATCHER_SIMPLE = 'simple'
 CONF_DISPATCHER_MANUAL = 'manual'
 CONF_DISPATCHER_DUMMY = 'dummy'
+CONF_DIAGNOSTICS = 'diagnostics'
+CONF_DISPATCH_MODE = 'dispatch_mode'
 CONF_DURATION_ON = 'duration_on'
 CONF_DURATION_DIM = 'duration_dim'
+CONF_EVENT_WINDOW = 'event_window'
 CONF_OVERRIDES = 'overrides'
+CONF_PRIORITY = 'priority'
 CONF_SCENE = 'scene'
 CONF_SERVICE = 'service'
 CONF_SERVICE_DATA = 'service_data'
 CONF_TIMER = 'timer'
+CONF_TO = 'to'
+CONF_TRANSITION_ATTRIBUTES = 'transition_attributes'
+CONF_TRIGGERS = 'triggers'
 
 STATE_AUTO_ON = 'auto_on'
 STATE_MANUAL_ON = 'manual_on'
@@ -25,7 +34,18 @@ ALL_STATES = [STATE_AUTO_ON, STATE_MANUAL_ON, STATE_DIM, STATE_OFF]
 AUTO_CHANGEABLE_STATES = [STATE_AUTO_ON, STATE_DIM, STATE_OFF]
 DEFAULT_STATE = STATE_OFF
 
+DISPATCH_MODE_TREE = 'tree'
+DISPATCH_MODE_COMPILED = 'compiled'
+
+STORAGE_KEY = DOMAIN
+STORAGE_VERSION = 1
+
 SERVICE_HANDLE_EVENT = 'handle_event'
+SERVICE_DUMP_STATS = 'dump_stats'
+SERVICE_RELOAD = 'reload'
+
+ATTR_LAST_TRANSITION = 'last_transition'
+ATTR_PREVIOUS_STATE = 'previous_state'
 
 ATTR_CONTROLLER = 'controller'
 ATTR_EVENT_TYPE = 'type'  # <-- key in service call data dict, and below come values:
@@ -1,21 +1,75 @@
 """The state_enforcer integration."""
 import asyncio
+import collections
+import functools
+import heapq
+import itertools
 import logging
+import random
+import sys
 import voluptuous as vol
 import homeassistant.core
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import (async_track_state_change_event,
+                                         async_track_time_interval)
+from homeassistant.helpers.reload import async_integration_yaml_config
+from homeassistant.helpers.storage import Store
 from homeassistant.setup import async_setup_component
 from homeassistant.const import (ATTR_ENTITY_ID, ATTR_SERVICE,
-                                 ATTR_SERVICE_DATA, ATTR_STATE, CONF_ENTITY_ID,
-                                 EVENT_STATE_CHANGED, STATE_ON, STATE_OFF)
+                                 ATTR_SERVICE_DATA, ATTR_STATE, CONF_ENTITIES,
+                                 CONF_ENTITY_ID, STATE_ON, STATE_OFF,
+                                 STATE_UNAVAILABLE, STATE_UNKNOWN)
 
 from .const import *
 
 SLEEP_BASE = 3
 SLEEP_MULTIPLIER = 1.5
+SLEEP_MIN = 0.5
 SLEEP_MAX = 180
+SLEEP_JITTER = 0.2
+LATENCY_MARGIN = 1.5
+LATENCY_EWMA_ALPHA = 0.3
+LATENCY_SAMPLES = 20
+LATENCY_PERCENTILE = 0.9
+LATENCY_MAX = 30
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_MAX_RETRIES = 10
+STORAGE_SAVE_DELAY = 10
+
+RATE_LIMIT_SCHEMA = vol.Schema(
+    {
+        CONF_RATE:
+        vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False)),
+        vol.Optional(CONF_BURST, default=1):
+        vol.All(vol.Coerce(int), vol.Range(min=1)),
+        vol.Optional(CONF_CONCURRENCY, default=1):
+        vol.All(vol.Coerce(int), vol.Range(min=1))
+    },
+    required=True)
+
+ENFORCER_CONFIG_SCHEMA = vol.Schema(
+    {
+        CONF_ENTITIES: [cv.entity_id],
+        vol.Optional(CONF_RATE_LIMITS, default=dict()):
+        vol.Schema({cv.string: RATE_LIMIT_SCHEMA}),
+        vol.Optional(CONF_DEBOUNCE, default=DEFAULT_DEBOUNCE):
+        vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_RECONCILE_INTERVAL):
+        vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(CONF_MAX_RETRIES, default=DEFAULT_MAX_RETRIES):
+        vol.All(vol.Coerce(int), vol.Range(min=0))
+    },
+    required=True)
 
-CONFIG_SCHEMA = vol.Schema({DOMAIN: [cv.entity_id]}, extra=vol.ALLOW_EXTRA)
+CONFIG_SCHEMA = vol.Schema(
+    {
+        DOMAIN:
+        vol.Any(
+            ENFORCER_CONFIG_SCHEMA,
+            vol.All([cv.entity_id],
+                    lambda e: ENFORCER_CONFIG_SCHEMA({CONF_ENTITIES: e})))
+    },
+    extra=vol.ALLOW_EXTRA)
 
 LIGHT_SERVICES = {STATE_ON: 'light.turn_on', STATE_OFF: 'light.turn_off'}
 
@@ -26,9 +80,11 @@ SERVICE_SET_STATE_SCHEMA = vol.Schema(
     {
         ATTR_ENTITY_ID: ONE_OR_MANY_ENTITIES_TO_LIST,
         ATTR_SERVICE: cv.entity_id,
-        vol.Optional(ATTR_SERVICE_DATA): dict(),
+        vol.Optional(ATTR_SERVICE_DATA):
+        vol.Schema({}, extra=vol.ALLOW_EXTRA),
         ATTR_STATE: cv.string,
-        vol.Optional(ATTR_STATE_ATTRIBUTES): dict()
+        vol.Optional(ATTR_STATE_ATTRIBUTES):
+        vol.Schema({}, extra=vol.ALLOW_EXTRA)
     },
     extra=vol.ALLOW_EXTRA,
     required=True)
@@ -37,12 +93,26 @@ SERVICE_SET_LIGHT_SCHEMA = vol.Schema(
     {
         ATTR_ENTITY_ID: ONE_OR_MANY_ENTITIES_TO_LIST,
         ATTR_STATE: vol.In(LIGHT_SERVICES),
-        vol.Optional(ATTR_BRIGHTNESS): int
+        vol.Optional(ATTR_BRIGHTNESS): int,
+        vol.Optional(ATTR_TRANSITION): vol.All(vol.Coerce(float),
+                                               vol.Range(min=0))
+    },
+    extra=vol.ALLOW_EXTRA,
+    required=True)
+
+SERVICE_SET_MANY_SCHEMA = vol.Schema(
+    {
+        ATTR_TARGETS: [
+            vol.Any(
+                SERVICE_SET_STATE_SCHEMA.extend({}, extra=vol.PREVENT_EXTRA),
+                SERVICE_SET_LIGHT_SCHEMA.extend({}, extra=vol.PREVENT_EXTRA))
+        ]
     },
     extra=vol.ALLOW_EXTRA,
     required=True)
 
 state_enforcers = dict()
+limiters = dict()
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -50,33 +120,108 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup(hass, config):
     """Set up the state_enforcer integration."""
     # try/catch?
-    for entity_id in config[DOMAIN]:
+    enforcer_config = config[DOMAIN]
+    set_up_limiters(hass, enforcer_config)
+    reconciler = Reconciler(hass)
+    reconciler.configure(enforcer_config.get(CONF_RECONCILE_INTERVAL))
+    store = TargetStore(hass)
+    await store.async_load()
+    for entity_id in enforcer_config[CONF_ENTITIES]:
         state_enforcers[entity_id] = await StateEnforcer.create(
-            hass, entity_id)
+            hass, entity_id, enforcer_config, store)
 
-    register_service_handler(hass, SERVICE_SET_STATE, async_set_state,
+    register_service_handler(hass, SERVICE_SET_STATE, set_state_target,
                              SERVICE_SET_STATE_SCHEMA)
-    register_service_handler(hass, SERVICE_SET_LIGHT, async_set_light,
+    register_service_handler(hass, SERVICE_SET_LIGHT, set_light_target,
                              SERVICE_SET_LIGHT_SCHEMA)
-
-    hass.bus.async_listen(EVENT_STATE_CHANGED, async_on_state_changed)
+    hass.services.async_register(DOMAIN,
+                                 SERVICE_SET_MANY,
+                                 functools.partial(async_on_set_many, hass),
+                                 schema=SERVICE_SET_MANY_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_DUMP_STATS,
+        functools.partial(async_on_dump_stats, reconciler))
+    hass.services.async_register(
+        DOMAIN, SERVICE_RELOAD,
+        functools.partial(async_on_reload, hass, store, reconciler))
 
     return True
 
 
+def set_up_limiters(hass, enforcer_config):
+    """Keep limiters with unchanged config so their queues survive reload."""
+    limit_configs = enforcer_config[CONF_RATE_LIMITS]
+    for domain in list(limiters):
+        if limiters[domain].config != limit_configs.get(domain):
+            del limiters[domain]
+    for domain, limit_config in limit_configs.items():
+        if domain not in limiters:
+            limiters[domain] = ServiceCallLimiter(hass, limit_config)
+
+
+async def async_on_reload(hass, store, reconciler, event):
+    """Add and remove enforcers, keeping targets of the untouched ones."""
+    config = await async_integration_yaml_config(hass, DOMAIN)
+    if config is None:
+        return
+    enforcer_config = config.get(DOMAIN)
+    if enforcer_config is None:
+        enforcer_config = ENFORCER_CONFIG_SCHEMA({CONF_ENTITIES: []})
+    set_up_limiters(hass, enforcer_config)
+    reconciler.configure(enforcer_config.get(CONF_RECONCILE_INTERVAL))
+    entity_ids = enforcer_config[CONF_ENTITIES]
+    for entity_id in list(state_enforcers):
+        if entity_id not in entity_ids:
+            _LOGGER.info(f'Removing enforcer of {entity_id}')
+            state_enforcers.pop(entity_id).stop()
+    for entity_id in entity_ids:
+        state_enforcer = state_enforcers.get(entity_id)
+        if state_enforcer is None:
+            _LOGGER.info(f'Creating enforcer of {entity_id}')
+            state_enforcers[entity_id] = await StateEnforcer.create(
+                hass, entity_id, enforcer_config, store)
+        else:
+            state_enforcer.apply_config(enforcer_config)
+
+
+async def async_on_dump_stats(reconciler, event):
+    for entity_id, state_enforcer in state_enforcers.items():
+        _LOGGER.info(f'Stats of {entity_id}: {state_enforcer.get_stats()}')
+    for domain, limiter in limiters.items():
+        _LOGGER.info(f'Rate limiter of {domain}: {limiter.get_stats()}')
+    if reconciler.interval is not None:
+        _LOGGER.info(f'Reconciler: {reconciler.get_stats()}')
+
+
+async def async_call_service(hass, service, service_data, priority):
+    limiter = limiters.get(service.domain)
+    if limiter is None:
+        await hass.services.async_call(service.domain, service.name,
+                                       service_data)
+    else:
+        await limiter.async_call(service, service_data, priority)
+
+
+def select_enforcers(service_name, entity_ids):
+    selected_enforcers = []
+    for entity_id in entity_ids:
+        state_enforcer = state_enforcers.get(entity_id)
+        if state_enforcer is None:
+            _LOGGER.error(f'Got service {service_name} call '
+                          f'with {ATTR_ENTITY_ID} = {entity_id} '
+                          'which is not set up!')
+        else:
+            selected_enforcers.append(state_enforcer)
+    return selected_enforcers
+
+
 def register_service_handler(hass, service_name, handler, schema):
     async def service_handler_wrapper(event):
-        selected_enforcers = []
-        for entity_id in event.data[ATTR_ENTITY_ID]:
-            state_enforcer = state_enforcers.get(entity_id)
-            if state_enforcer is None:
-                _LOGGER.error(f'Got service {service_name} call '
-                              f'with {ATTR_ENTITY_ID} = {entity_id} '
-                              'which is not set up!')
-            else:
-                selected_enforcers.append(state_enforcer)
-        await asyncio.gather(*(handler(state_enforcer, event)
-                               for state_enforcer in selected_enforcers))
+        selected_enforcers = select_enforcers(service_name,
+                                              event.data[ATTR_ENTITY_ID])
+        for state_enforcer in selected_enforcers:
+            handler(state_enforcer, event.data)
+        await async_enforce_batch(hass, selected_enforcers)
 
     hass.services.async_register(DOMAIN,
                                  service_name,
@@ -84,101 +229,564 @@ def register_service_handler(hass, service_name, handler, schema):
                                  schema=schema)
 
 
-async def async_set_state(state_enforcer, event):
-    await state_enforcer.handle_enforce_state(
-        service=event.data[ATTR_SERVICE],
-        service_data=event.data.get(ATTR_SERVICE_DATA, dict()),
-        state=event.data[ATTR_STATE],
-        state_attrs=event.data.get(ATTR_STATE_ATTRIBUTES, dict()))
+async def async_on_set_many(hass, event):
+    """Apply per-entity targets in a single grouped enforcement pass."""
+    selected_enforcers = dict()
+    for target in event.data[ATTR_TARGETS]:
+        handler = set_state_target if ATTR_SERVICE in target else set_light_target
+        for state_enforcer in select_enforcers(SERVICE_SET_MANY,
+                                               target[ATTR_ENTITY_ID]):
+            handler(state_enforcer, target)
+            selected_enforcers[state_enforcer.entity_id] = state_enforcer
+    await async_enforce_batch(hass, list(selected_enforcers.values()))
 
 
-async def async_set_light(state_enforcer, event):
-    on_off = event.data[ATTR_STATE]
+def set_state_target(state_enforcer, data):
+    state_enforcer.set_target(
+        service=data[ATTR_SERVICE],
+        service_data=data.get(ATTR_SERVICE_DATA, dict()),
+        state=data[ATTR_STATE],
+        state_attrs=data.get(ATTR_STATE_ATTRIBUTES, dict()))
+
+
+def set_light_target(state_enforcer, data):
+    on_off = data[ATTR_STATE]
     state_attrs = dict()
-    if event.data.get(ATTR_BRIGHTNESS) is not None:
-        state_attrs[ATTR_BRIGHTNESS] = event.data.get(ATTR_BRIGHTNESS)
+    if data.get(ATTR_BRIGHTNESS) is not None:
+        state_attrs[ATTR_BRIGHTNESS] = data.get(ATTR_BRIGHTNESS)
     service_data = state_attrs.copy()
-    service_data[ATTR_ENTITY_ID] = event.data[ATTR_ENTITY_ID]
-    await state_enforcer.handle_enforce_state(service=LIGHT_SERVICES[on_off],
-                                              service_data=service_data,
-                                              state=on_off,
-                                              state_attrs=state_attrs)
+    service_data[ATTR_ENTITY_ID] = state_enforcer.entity_id
+    transition = data.get(ATTR_TRANSITION, 0)
+    if transition > 0:
+        # The light fades on its own; only the final state is verified.
+        service_data[ATTR_TRANSITION] = transition
+    state_enforcer.set_target(service=LIGHT_SERVICES[on_off],
+                              service_data=service_data,
+                              state=on_off,
+                              state_attrs=state_attrs,
+                              transition=transition)
+
+
+async def async_enforce_batch(hass, enforcers):
+    """Issue one service call per group of enforcers sharing the same target,
+    then let each enforcer verify and retry on its own."""
+    calls = group_service_calls(enforcers)
+    for state_enforcer in enforcers:
+        state_enforcer.begin_call()
+    await asyncio.gather(
+        *(async_call_service(hass, service, service_data, PRIORITY_TARGET)
+          for service, service_data in calls))
+    for state_enforcer in enforcers:
+        if not state_enforcer.reconciling:
+            state_enforcer.start_task(state_enforcer.async_verify())
+
+
+def group_service_calls(enforcers):
+    """Merge calls that only differ in targeting the enforcer's own entity
+    and deduplicate identical calls."""
+    groups = dict()
+    for state_enforcer in enforcers:
+        if state_enforcer.service is None:
+            continue
+        service_data = dict(state_enforcer.service_data)
+        mergeable = service_data.get(
+            ATTR_ENTITY_ID) == state_enforcer.entity_id
+        if mergeable:
+            del service_data[ATTR_ENTITY_ID]
+        key = (state_enforcer.service.full, mergeable,
+               make_hashable(service_data))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = (state_enforcer.service, service_data, [])
+        if mergeable:
+            group[2].append(state_enforcer.entity_id)
+    calls = list()
+    for service, service_data, entity_ids in groups.values():
+        if len(entity_ids) > 0:
+            service_data[ATTR_ENTITY_ID] = entity_ids
+        calls.append((service, service_data))
+    return calls
+
+
+def make_hashable(value):
+    if isinstance(value, dict):
+        return tuple(
+            sorted((k, make_hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(make_hashable(v) for v in value)
+    return value
+
+
+class ServiceCallLimiter(object):
+    """Token bucket and concurrency cap for the service calls of one domain.
+    Waiting calls are released lowest priority value first."""
+    def __init__(self, hass, config):
+        self.hass = hass
+        self.config = config
+        self.rate = config[CONF_RATE]
+        self.burst = config[CONF_BURST]
+        self.concurrency = config[CONF_CONCURRENCY]
+        self.tokens = self.burst
+        self.updated = hass.loop.time()
+        self.active = 0
+        self.queue = list()
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.max_queue_depth = 0
+        self.total_calls = 0
+
+    async def async_call(self, service, service_data, priority):
+        turn = self.hass.loop.create_future()
+        heapq.heappush(self.queue, (priority, next(self.sequence), turn))
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        self._release()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                self._finish()
+            else:
+                turn.cancel()
+            raise
+        try:
+            await self.hass.services.async_call(service.domain, service.name,
+                                                service_data)
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.active -= 1
+        self.total_calls += 1
+        self._release()
+
+    def _refill(self):
+        now = self.hass.loop.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _release(self):
+        self._refill()
+        while len(self.queue) > 0 and self.active < self.concurrency:
+            if self.queue[0][2].cancelled():
+                heapq.heappop(self.queue)
+                continue
+            if self.tokens < 1:
+                if self.wakeup is None:
+                    self.wakeup = self.hass.loop.call_later(
+                        (1 - self.tokens) / self.rate, self._on_wakeup)
+                return
+            _, _, turn = heapq.heappop(self.queue)
+            self.tokens -= 1
+            self.active += 1
+            turn.set_result(None)
+
+    def _on_wakeup(self):
+        self.wakeup = None
+        self._release()
+
+    def get_stats(self):
+        return {
+            'queue_depth': len(self.queue),
+            'max_queue_depth': self.max_queue_depth,
+            'active': self.active,
+            'calls': self.total_calls
+        }
+
+
+class Reconciler(object):
+    """Periodically sweeps all enforcers in one pass and issues grouped
+    corrective calls for the drifted ones. While enabled, enforcers run no
+    verification or debounce tasks of their own."""
+    def __init__(self, hass):
+        self.hass = hass
+        self.logger = _LOGGER.getChild('reconciler')
+        self.interval = None
+        self.remove_listener = None
+        self.sweep_task = None
+        self.sweeps = 0
+        self.corrections = 0
+        self.calls = 0
+
+    def configure(self, interval):
+        if interval == self.interval:
+            return
+        self.stop()
+        self.interval = interval
+        if interval is not None:
+            self.logger.debug(f'Reconciling every {interval}.')
+            self.remove_listener = async_track_time_interval(
+                self.hass, self.on_interval, interval)
+
+    def stop(self):
+        if self.remove_listener is not None:
+            self.remove_listener()
+            self.remove_listener = None
+
+    @homeassistant.core.callback
+    def on_interval(self, now=None):
+        if self.sweep_task is not None and not self.sweep_task.done():
+            # The previous corrections are still queued in a limiter.
+            return
+        self.sweep_task = self.hass.async_create_task(self.async_sweep())
+
+    async def async_sweep(self):
+        self.sweeps += 1
+        drifted = list()
+        for state_enforcer in state_enforcers.values():
+            if state_enforcer.is_drifted():
+                if state_enforcer.register_retry():
+                    drifted.append(state_enforcer)
+            elif state_enforcer.state is not None and state_enforcer.matches():
+                state_enforcer.reset_retries()
+        if len(drifted) == 0:
+            return
+        calls = group_service_calls(drifted)
+        self.logger.debug(f'Correcting {len(drifted)} drifted entities '
+                          f'with {len(calls)} service calls.')
+        self.corrections += len(drifted)
+        self.calls += len(calls)
+        for state_enforcer in drifted:
+            state_enforcer.begin_call()
+        await asyncio.gather(
+            *(async_call_service(self.hass, service, service_data,
+                                 PRIORITY_RETRY)
+              for service, service_data in calls))
+
+    def get_stats(self):
+        return {
+            'sweeps': self.sweeps,
+            'corrections': self.corrections,
+            'calls': self.calls
+        }
+
+
+class LatencyTracker(object):
+    """Learns how long an entity takes to confirm a service call."""
+    __slots__ = ('loop', 'ewma', 'samples', 'started')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.ewma = None
+        self.samples = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.started = None
+
+    def start(self, transition=0):
+        """The transition is not part of the learned latency."""
+        self.started = self.loop.time() + transition
+
+    def cancel(self):
+        """The call changed nothing, so no confirmation will follow."""
+        self.started = None
+
+    def confirm(self):
+        if self.started is None:
+            return
+        latency = max(self.loop.time() - self.started, 0)
+        self.started = None
+        if latency > LATENCY_MAX:
+            # Not a confirmation of the call but some later change.
+            return
+        self.samples.append(latency)
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma += LATENCY_EWMA_ALPHA * (latency - self.ewma)
 
+    def get_percentile(self):
+        if len(self.samples) == 0:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * LATENCY_PERCENTILE),
+                           len(ordered) - 1)]
 
-async def async_on_state_changed(event):
-    state_enforcer = state_enforcers.get(event.data[ATTR_ENTITY_ID])
-    if state_enforcer is None:
-        return
-    await state_enforcer.async_on_state_changed(event)
+
+class TargetStore(object):
+    """Enforced targets, saved with a delay so that bursts of set_* calls
+    end up in one write."""
+    def __init__(self, hass):
+        self.store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self.data = dict()
+
+    async def async_load(self):
+        self.data = await self.store.async_load() or dict()
+
+    def get(self, entity_id):
+        return self.data.get(entity_id)
+
+    def update(self, entity_id, target):
+        self.data[entity_id] = target
+        self.store.async_delay_save(lambda: self.data, STORAGE_SAVE_DELAY)
 
 
 class StateEnforcer(object):
+    __slots__ = ('hass', 'entity_id', 'logger', 'debounce', 'max_retries',
+                 'latency', 'service', 'service_data', 'state', 'state_attrs',
+                 'retry_number', 'gave_up', 'total_retries', 'total_targets',
+                 'task', 'debounce_handle', 'confirmation', 'store',
+                 'remove_listener', 'transition', 'settle_until',
+                 'reconciling')
+
     @staticmethod
-    async def create(hass, entity_id):
+    async def create(hass, entity_id, config, store):
         new_obj = StateEnforcer()
         new_obj.hass = hass
-        new_obj.entity_id = entity_id
+        new_obj.entity_id = sys.intern(entity_id)
         new_obj.logger = _LOGGER.getChild(entity_id)
+        new_obj.apply_config(config)
+        new_obj.latency = LatencyTracker(hass.loop)
 
         new_obj.service = None
         new_obj.service_data = dict()
         new_obj.state = None
         new_obj.state_attrs = dict()
+        new_obj.transition = 0
+        new_obj.settle_until = None
         new_obj.retry_number = 0
+        new_obj.gave_up = False
+        new_obj.total_retries = 0
+        new_obj.total_targets = 0
+        new_obj.task = None
+        new_obj.debounce_handle = None
+        new_obj.confirmation = None
+        new_obj.store = store
+        new_obj.restore_target(store.get(entity_id))
+        new_obj.remove_listener = async_track_state_change_event(
+            hass, [entity_id], new_obj.on_state_changed)
         return new_obj
 
-    async def async_on_state_changed(self, event):
-        await self.check_current_state()
+    def apply_config(self, config):
+        self.debounce = config[CONF_DEBOUNCE]
+        self.max_retries = config[CONF_MAX_RETRIES]
+        self.reconciling = config.get(CONF_RECONCILE_INTERVAL) is not None
+
+    def stop(self):
+        self.cancel()
+        self.remove_listener()
 
-    async def handle_enforce_state(self, service, service_data, state, state_attrs):
+    def restore_target(self, stored):
+        """Take over the target from before restart without enforcing it;
+        enforcement resumes once the entity reports a drift."""
+        if stored is None:
+            return
+        self.service = SplitId(stored['service'])
+        self.service_data = stored['service_data']
+        self.state = stored['state']
+        self.state_attrs = stored['state_attrs']
+        self.transition = stored.get('transition', 0)
+
+    @homeassistant.core.callback
+    def on_state_changed(self, event):
+        if (self.latency.started is not None
+                or self.confirmation is not None) and self.matches():
+            self.latency.confirm()
+            if self.confirmation is not None and not self.confirmation.done():
+                self.confirmation.set_result(None)
+        if self.is_enforcing() or self.reconciling:
+            # The in-flight enforcement or the next sweep verifies the state.
+            return
+        self.cancel_debounce()
+        self.debounce_handle = self.hass.loop.call_later(
+            self.debounce, self.on_debounced)
+
+    @homeassistant.core.callback
+    def on_debounced(self):
+        self.debounce_handle = None
+        if self.state is None or self.is_unavailable():
+            return
+        settle_delay = self.get_settle_delay()
+        if settle_delay > 0:
+            # Some lights report the final state first and then step through
+            # the transition; judge the state once it is over.
+            self.debounce_handle = self.hass.loop.call_later(
+                settle_delay + self.debounce, self.on_debounced)
+            return
+        if self.matches():
+            self.reset_retries()
+            return
+        if not self.register_retry():
+            return
+        self.logger.debug(f'State drifted from enforced state {self.state} '
+                          f'{self.state_attrs}. Retrying service call '
+                          f'(#{self.retry_number})')
+        self.start_task(self.enforce())
+
+    def register_retry(self):
+        """Returns False once the retry budget for the target is spent."""
+        if self.retry_number >= self.max_retries:
+            if not self.gave_up:
+                self.gave_up = True
+                self.logger.warning(
+                    f'Giving up enforcing {self.state} {self.state_attrs} '
+                    f'after {self.max_retries} retries.')
+            return False
+        self.retry_number += 1
+        self.total_retries += 1
+        return True
+
+    def reset_retries(self):
+        """The target was confirmed; a later drift gets a fresh budget."""
+        self.retry_number = 0
+        self.gave_up = False
+
+    def set_target(self,
+                   service,
+                   service_data,
+                   state,
+                   state_attrs,
+                   transition=0):
+        self.cancel()
         self.service = SplitId(service)
         self.service_data = service_data
         self.state = state
         self.state_attrs = state_attrs
-        self.retry_number = 0
+        self.transition = transition
+        self.reset_retries()
+        self.total_targets += 1
+        self.store.update(self.entity_id, {
+            'service': service,
+            'service_data': service_data,
+            'state': state,
+            'state_attrs': state_attrs,
+            'transition': transition
+        })
         self.logger.debug(f'Set enforsing: '
                      f'service={self.service} '
                      f'service_data={self.service_data} '
                      f'state={self.state} '
                      f'state_attrs={self.state_attrs} ')
-        await self.enforce()
 
-    async def check_current_state(self):
+    def is_enforcing(self):
+        return self.task is not None and not self.task.done()
+
+    def start_task(self, coro):
+        """Run coro as the only in-flight enforcement of this entity."""
+        self.cancel()
+        self.task = self.hass.async_create_task(coro)
+
+    def cancel(self):
+        self.cancel_debounce()
+        if self.is_enforcing():
+            self.task.cancel()
+        self.task = None
+
+    def cancel_debounce(self):
+        if self.debounce_handle is not None:
+            self.debounce_handle.cancel()
+            self.debounce_handle = None
+
+    def matches(self):
         current_state = self.hass.states.get(self.entity_id)
-        if self.state is None:
-            self.logger.debug('Ignoring call to check_current_state '
-                              'because the enforced state is not set yet.')
-            return
-        if current_state.state != self.state or any(
-                current_state.attributes.get(k) != v
-                for k, v in self.state_attrs.items()):
-            self.retry_number += 1
-            self.logger.debug(
-                f'Current state {current_state} does not match '
-                f'enforced state {self.state} {self.state_attrs}. '
-                f'Retrying service call (#{self.retry_number})')
-            await self.enforce()
-        else:
-            self.logger.debug('check_current_state(): states match!')
+        if current_state is None:
+            return False
+        return current_state.state == self.state and all(
+            current_state.attributes.get(k) == v
+            for k, v in self.state_attrs.items())
+
+    def is_unavailable(self):
+        """Calls to an entity that is gone or not yet set up only burn the
+        retry budget; it is enforced once it reports a real state."""
+        current_state = self.hass.states.get(self.entity_id)
+        return current_state is None or current_state.state in (
+            STATE_UNAVAILABLE, STATE_UNKNOWN)
 
     async def enforce(self):
         if self.service is None:
             self.logger.error(f'Cannot enforce state {self.state} '
                               f'with attrs {self.state_attrs} because '
                               'the service call is not set.')
-        await self.hass.services.async_call(self.service.domain,
-                                            self.service.name,
-                                            self.service_data)
-        await asyncio.sleep(self.get_sleep_delay())
-        await self.check_current_state()
+            return
+        await self.async_call_service()
+        await self.async_verify()
+
+    def begin_call(self):
+        """Note that a service call for the target is about to be issued."""
+        self.settle_until = self.hass.loop.time() + self.transition
+        self.latency.start(self.transition)
+
+    def is_settling(self):
+        """Whether the last call may still be confirmed."""
+        return self.settle_until is not None and self.hass.loop.time(
+        ) < self.settle_until + self.get_confirmation_delay()
+
+    def is_drifted(self):
+        return (self.state is not None and not self.is_settling()
+                and not self.is_unavailable() and not self.matches())
+
+    def get_settle_delay(self):
+        """Time left until the light should have finished its transition."""
+        if self.settle_until is None:
+            return 0
+        return max(self.settle_until - self.hass.loop.time(), 0)
+
+    async def async_call_service(self):
+        self.begin_call()
+        await async_call_service(self.hass, self.service, self.service_data,
+                                 PRIORITY_RETRY)
+
+    async def async_wait_for_confirmation(self, timeout):
+        """Wait until a matching state_changed arrives or timeout passes."""
+        if self.matches():
+            # Either already confirmed or the call was a no-op that fires
+            # no state_changed at all.
+            self.latency.cancel()
+            return
+        self.confirmation = self.hass.loop.create_future()
+        try:
+            await asyncio.wait_for(self.confirmation, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.confirmation = None
+
+    async def async_verify(self):
+        while True:
+            await self.async_wait_for_confirmation(self.get_settle_delay() +
+                                                   self.get_sleep_delay())
+            if self.matches():
+                self.logger.debug('async_verify(): states match!')
+                self.reset_retries()
+                return
+            if not self.register_retry():
+                return
+            self.logger.debug(
+                f'Current state {self.hass.states.get(self.entity_id)} '
+                f'does not match enforced state {self.state} '
+                f'{self.state_attrs}. '
+                f'Retrying service call (#{self.retry_number})')
+            await self.async_call_service()
+
+    def get_stats(self):
+        return {
+            'targets': self.total_targets,
+            'retries': self.total_retries,
+            'enforcing': self.is_enforcing(),
+            'latency_ewma': self.latency.ewma,
+            'latency_p90': self.latency.get_percentile()
+        }
 
     def get_sleep_delay(self):
-        return min(SLEEP_BASE + self.retry_number * SLEEP_MULTIPLIER,
-                   SLEEP_MAX)
+        """Verification timeout derived from the learned confirmation latency,
+        backed off per retry and jittered."""
+        delay = min(
+            self.get_confirmation_delay() *
+            SLEEP_MULTIPLIER**self.retry_number, SLEEP_MAX)
+        return delay * random.uniform(1 - SLEEP_JITTER, 1 + SLEEP_JITTER)
+
+    def get_confirmation_delay(self):
+        percentile = self.latency.get_percentile()
+        if percentile is None:
+            return SLEEP_BASE
+        return min(max(percentile * LATENCY_MARGIN, SLEEP_MIN), LATENCY_MAX)
 
 
 class SplitId(object):
+    __slots__ = ('domain', 'name', 'full')
+
     def __init__(self, entity_id):
         assert (entity_id is not None)
-        self.domain, self.name = homeassistant.core.split_entity_id(entity_id)
+        entity_id = sys.intern(entity_id)
+        domain, name = homeassistant.core.split_entity_id(entity_id)
+        self.domain = sys.intern(domain)
+        self.name = sys.intern(name)
         self.full = entity_id
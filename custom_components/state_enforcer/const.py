@@ -2,8 +2,27 @@
 
 DOMAIN = 'state_enforcer'
 
+CONF_DEBOUNCE = 'debounce'
+CONF_MAX_RETRIES = 'max_retries'
+CONF_RATE_LIMITS = 'rate_limits'
+CONF_RATE = 'rate'
+CONF_BURST = 'burst'
+CONF_CONCURRENCY = 'concurrency'
+CONF_RECONCILE_INTERVAL = 'reconcile_interval'
+
+PRIORITY_TARGET = 0
+PRIORITY_RETRY = 1
+
+STORAGE_KEY = DOMAIN
+STORAGE_VERSION = 1
+
 SERVICE_SET_STATE = 'set_state'
 SERVICE_SET_LIGHT = 'set_light'
+SERVICE_SET_MANY = 'set_many'
+SERVICE_DUMP_STATS = 'dump_stats'
+SERVICE_RELOAD = 'reload'
 
 ATTR_STATE_ATTRIBUTES = 'state_attributes'
 ATTR_BRIGHTNESS = 'brightness'
+ATTR_TARGETS = 'targets'
+ATTR_TRANSITION = 'transition'
@@ -0,0 +1,24 @@
+import inspect
+
+import pytest
+
+import harness
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    """Run coroutine tests on a fresh loop with a virtual clock."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {
+        name: pyfuncitem.funcargs[name]
+        for name in pyfuncitem._fixtureinfo.argnames
+    }
+    harness.run(pyfuncitem.obj(**arguments))
+    return True
+
+
+@pytest.fixture(autouse=True)
+def reset_integrations():
+    harness.reset_integrations()
+    yield
+    harness.reset_integrations()
@@ -0,0 +1,606 @@
+"""Offline simulation harness for complex_controller and state_enforcer.
+
+FakeHass provides the state machine, the service registry and the event bus
+on an event loop driven by VirtualClock: whenever the loop would wait, the
+clock jumps to the next scheduled callback instead, so a simulated day runs
+in seconds and timer behaviour is deterministic. FakeLights and the timer
+platform answer the service calls the integrations issue. Event streams can
+be generated or loaded from JSON lines and replayed with async_replay().
+"""
+import asyncio
+import collections
+import datetime
+import importlib
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+for path in (os.path.join(ROOT_DIR, 'custom_components'),
+             os.path.join(TESTS_DIR, 'stubs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import homeassistant.util.dt as dt_util
+from homeassistant.const import (ATTR_ENTITY_ID, EVENT_STATE_CHANGED,
+                                 MATCH_ALL, STATE_OFF, STATE_ON)
+from homeassistant.core import Event, ServiceCall, State, is_callback
+from homeassistant.exceptions import ServiceNotFound
+
+_LOGGER = logging.getLogger(__name__)
+
+INTEGRATIONS = ('complex_controller', 'state_enforcer')
+EPOCH = datetime.datetime(2020, 10, 1, tzinfo=datetime.timezone.utc)
+
+
+class VirtualClock(object):
+    """Replaces loop.time() and makes the selector advance time instead of
+    blocking."""
+    def __init__(self, loop, start=EPOCH):
+        self.loop = loop
+        self.start = start
+        self.now = 0.0
+        loop.time = self.time
+        selector = loop._selector
+        real_select = selector.select
+
+        def select(timeout=None):
+            events = real_select(0)
+            if len(events) == 0 and timeout is not None and timeout > 0:
+                self.now += timeout
+            elif len(events) == 0 and timeout is None:
+                raise RuntimeError('Event loop would block forever.')
+            return events
+
+        selector.select = select
+
+    def time(self):
+        return self.now
+
+    def utcnow(self):
+        return self.start + datetime.timedelta(seconds=self.now)
+
+
+def run(coro, virtual_time=True):
+    """Run a coroutine on a fresh loop, with a virtual clock by default."""
+    loop = asyncio.new_event_loop()
+    clock = VirtualClock(loop) if virtual_time else None
+    previous_now_func = dt_util.now_func
+    if clock is not None:
+        dt_util.now_func = clock.utcnow
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+        for task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
+        dt_util.now_func = previous_now_func
+        loop.close()
+
+
+def reset_integrations():
+    """Clear the module-level registries of the integrations."""
+    for name in INTEGRATIONS:
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        for registry in ('controllers', 'state_enforcers', 'limiters'):
+            if hasattr(module, registry):
+                getattr(module, registry).clear()
+
+
+class EventBus(object):
+    def __init__(self, hass):
+        self.hass = hass
+        self.listeners = collections.defaultdict(list)
+        self.fired = collections.Counter()
+
+    def async_listen(self, event_type, listener):
+        self.listeners[event_type].append(listener)
+
+        def remove_listener():
+            if listener in self.listeners[event_type]:
+                self.listeners[event_type].remove(listener)
+
+        return remove_listener
+
+    def async_fire(self, event_type, data=None):
+        event = Event(event_type, data)
+        self.fired[event_type] += 1
+        for listener in (self.listeners.get(event_type, []) +
+                         self.listeners.get(MATCH_ALL, [])):
+            self.hass.async_run_job(listener, event)
+
+
+class StateMachine(object):
+    def __init__(self, hass):
+        self.hass = hass
+        self.states = dict()
+        self.writes = collections.Counter()
+
+    def get(self, entity_id):
+        return self.states.get(entity_id.lower())
+
+    def async_entity_ids(self, domain=None):
+        return [
+            entity_id for entity_id in self.states
+            if domain is None or entity_id.startswith(f'{domain}.')
+        ]
+
+    def async_all(self):
+        return list(self.states.values())
+
+    def async_set(self, entity_id, new_state, attributes=None,
+                  force_update=False):
+        """Like Home Assistant, a write that changes nothing fires no
+        state_changed event."""
+        entity_id = entity_id.lower()
+        new_state = str(new_state)
+        attributes = dict(attributes or {})
+        old_state = self.states.get(entity_id)
+        same_state = old_state is not None and old_state.state == new_state
+        if (same_state and old_state.attributes == attributes
+                and not force_update):
+            return
+        last_changed = old_state.last_changed if same_state else None
+        state = State(entity_id, new_state, attributes, last_changed)
+        self.states[entity_id] = state
+        self.writes[entity_id] += 1
+        self.hass.bus.async_fire(EVENT_STATE_CHANGED, {
+            'entity_id': entity_id,
+            'old_state': old_state,
+            'new_state': state
+        })
+
+    def async_remove(self, entity_id):
+        entity_id = entity_id.lower()
+        old_state = self.states.pop(entity_id, None)
+        if old_state is None:
+            return False
+        self.hass.bus.async_fire(EVENT_STATE_CHANGED, {
+            'entity_id': entity_id,
+            'old_state': old_state,
+            'new_state': None
+        })
+        return True
+
+
+ServiceRecord = collections.namedtuple(
+    'ServiceRecord', ['domain', 'service', 'data', 'time', 'perf'])
+
+
+class ServiceRegistry(object):
+    """Calls always run to completion; every call is recorded."""
+    def __init__(self, hass):
+        self.hass = hass
+        self.services = dict()
+        self.calls = list()
+        self.listeners = list()
+
+    def async_register(self, domain, service, service_func, schema=None):
+        self.services[domain, service] = (service_func, schema)
+
+    def has_service(self, domain, service):
+        return (domain, service) in self.services
+
+    async def async_call(self, domain, service, service_data=None,
+                         blocking=False):
+        service_data = dict(service_data or {})
+        record = ServiceRecord(domain, service, service_data,
+                               self.hass.loop.time(), time.perf_counter())
+        self.calls.append(record)
+        for listener in self.listeners:
+            listener(record)
+        registered = self.services.get((domain, service))
+        if registered is None:
+            raise ServiceNotFound(domain, service)
+        service_func, schema = registered
+        if schema is not None:
+            service_data = schema(service_data)
+        result = service_func(ServiceCall(domain, service, service_data))
+        if inspect.isawaitable(result):
+            await result
+
+    def get_calls(self, domain=None, service=None):
+        return [
+            call for call in self.calls
+            if (domain is None or call.domain == domain) and (
+                service is None or call.service == service)
+        ]
+
+    def count_calls(self):
+        return collections.Counter(f'{call.domain}.{call.service}'
+                                   for call in self.calls)
+
+
+class FakeHass(object):
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.data = dict()
+        self.storage = dict()
+        self.yaml_config = dict()
+        self.bus = EventBus(self)
+        self.states = StateMachine(self)
+        self.services = ServiceRegistry(self)
+        self.components = set()
+        self.tasks = set()
+        self.errors = list()
+
+    def async_create_task(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors.append(task.exception())
+            _LOGGER.error('Error in task', exc_info=task.exception())
+
+    def async_run_job(self, target, *args):
+        if is_callback(target):
+            return target(*args)
+        result = target(*args)
+        if inspect.isawaitable(result):
+            return self.async_create_task(result)
+        return result
+
+    async def async_block_till_done(self):
+        """Run until no tasks are pending and the loop is idle, without
+        advancing the clock."""
+        while True:
+            for _ in range(3):
+                await asyncio.sleep(0)
+            pending = [task for task in self.tasks if not task.done()]
+            if len(pending) == 0:
+                return
+            await asyncio.wait(pending)
+
+    async def async_advance(self, seconds):
+        """Let virtual time pass, running everything due meanwhile."""
+        await asyncio.sleep(seconds)
+        await self.async_block_till_done()
+
+    async def async_setup_component(self, domain, config):
+        if domain in self.components:
+            return True
+        if domain == 'timer':
+            FakeTimers(self, config.get('timer', {}))
+        elif domain in INTEGRATIONS:
+            module = importlib.import_module(domain)
+            self.yaml_config[domain] = config.get(domain)
+            config = module.CONFIG_SCHEMA(config)
+            if not await module.async_setup(self, config):
+                return False
+        else:
+            raise ValueError(f'The harness can not set up {domain}')
+        self.components.add(domain)
+        return True
+
+
+class FakeTimers(object):
+    """The timer integration: start, cancel and timer.finished events."""
+    def __init__(self, hass, config):
+        self.hass = hass
+        self.handles = dict()
+        for name in config:
+            hass.states.async_set(f'timer.{name}', 'idle')
+        hass.services.async_register('timer', 'start', self.async_start)
+        hass.services.async_register('timer', 'cancel', self.async_cancel)
+
+    async def async_start(self, call):
+        entity_id = call.data[ATTR_ENTITY_ID]
+        self._cancel(entity_id)
+        duration = parse_duration(call.data.get('duration', '0'))
+        self.handles[entity_id] = self.hass.loop.call_later(
+            duration, self._on_finished, entity_id)
+        self.hass.states.async_set(entity_id, 'active',
+                                   {'duration': str(duration)})
+
+    async def async_cancel(self, call):
+        entity_id = call.data[ATTR_ENTITY_ID]
+        if self._cancel(entity_id):
+            self.hass.states.async_set(entity_id, 'idle')
+            self.hass.bus.async_fire('timer.cancelled',
+                                     {ATTR_ENTITY_ID: entity_id})
+
+    def _cancel(self, entity_id):
+        handle = self.handles.pop(entity_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def _on_finished(self, entity_id):
+        del self.handles[entity_id]
+        self.hass.states.async_set(entity_id, 'idle')
+        self.hass.bus.async_fire('timer.finished', {ATTR_ENTITY_ID: entity_id})
+
+
+def parse_duration(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class FakeLights(object):
+    """light.turn_on/turn_off that report the new state after a latency.
+
+    A transition is reported as intermediate brightness steps, unless
+    final_first is set: then the final state is reported at once and the
+    steps follow, as some integrations do. Entities in unresponsive ignore
+    calls."""
+    def __init__(self, hass, latency=0.05, steps=4, final_first=False):
+        self.hass = hass
+        self.latency = latency
+        self.steps = steps
+        self.final_first = final_first
+        self.unresponsive = set()
+        self.calls = 0
+        hass.services.async_register('light', 'turn_on', self.async_turn_on)
+        hass.services.async_register('light', 'turn_off', self.async_turn_off)
+        hass.services.async_register('scene', 'turn_on', self.async_ignore)
+
+    def add(self, *entity_ids, state=STATE_OFF, **attributes):
+        for entity_id in entity_ids:
+            self.hass.states.async_set(entity_id, state, attributes)
+
+    async def async_turn_on(self, call):
+        self._handle(call, STATE_ON)
+
+    async def async_turn_off(self, call):
+        self._handle(call, STATE_OFF)
+
+    async def async_ignore(self, call):
+        pass
+
+    def _handle(self, call, state):
+        self.calls += 1
+        entity_ids = call.data[ATTR_ENTITY_ID]
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+        transition = float(call.data.get('transition', 0))
+        for entity_id in entity_ids:
+            if entity_id in self.unresponsive:
+                continue
+            attributes = dict()
+            if state == STATE_ON:
+                attributes['brightness'] = call.data.get('brightness', 255)
+            self._report(entity_id, state, attributes, transition)
+
+    def _report(self, entity_id, state, attributes, transition):
+        call_later = self.hass.loop.call_later
+        set_state = self.hass.states.async_set
+        if transition > 0 and self.steps > 0:
+            old_state = self.hass.states.get(entity_id)
+            start = 0
+            if old_state is not None and old_state.state == STATE_ON:
+                start = old_state.attributes.get('brightness', 0)
+            end = attributes.get('brightness', 0)
+            for step in range(1, self.steps + 1):
+                brightness = int(start + (end - start) * step /
+                                 (self.steps + 1))
+                call_later(self.latency + transition * step / self.steps,
+                           set_state, entity_id, STATE_ON,
+                           {'brightness': brightness})
+        if self.final_first or transition == 0:
+            call_later(self.latency, set_state, entity_id, state, attributes)
+        if transition > 0:
+            call_later(self.latency + transition + 0.01, set_state, entity_id,
+                       state, attributes)
+
+
+ReplayRecord = collections.namedtuple('ReplayRecord',
+                                      ['time', 'kind', 'target', 'value'])
+
+
+def load_events(path):
+    """Read a recorded stream: one JSON object per line, either
+    {"t": seconds, "controller": name, "type": event_type} or
+    {"t": seconds, "entity_id": id, "state": state}."""
+    records = list()
+    with open(path) as stream:
+        for line in stream:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            record = json.loads(line)
+            if 'controller' in record:
+                records.append(
+                    ReplayRecord(record['t'], 'event', record['controller'],
+                                 record['type']))
+            else:
+                records.append(
+                    ReplayRecord(record['t'], 'state', record['entity_id'],
+                                 record['state']))
+    records.sort(key=lambda record: record.time)
+    return records
+
+
+def generate_motion_day(rooms, seed=0, duration=24 * 3600):
+    """Motion sensor activity for a day: quiet at night, busy in the
+    evening, with short bursts of repeated triggers while someone moves."""
+    rng = random.Random(seed)
+    records = list()
+    for room in rooms:
+        sensor = f'binary_sensor.{room}_motion'
+        t = rng.uniform(0, 600)
+        while t < duration:
+            hour = (t / 3600) % 24
+            busy = 6 <= hour < 9 or 17 <= hour < 23
+            for _ in range(rng.randint(1, 6 if busy else 2)):
+                records.append(ReplayRecord(t, 'state', sensor, STATE_ON))
+                t += rng.uniform(5, 20)
+                records.append(ReplayRecord(t, 'state', sensor, STATE_OFF))
+                t += rng.uniform(1, 30)
+            t += rng.expovariate(1 / (900 if busy else 5400))
+    records.sort(key=lambda record: record.time)
+    return records
+
+
+def percentile(samples, fraction):
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ReplayReport(object):
+    def __init__(self, latencies, wall_time, simulated_time, service_calls):
+        self.latencies = latencies
+        self.wall_time = wall_time
+        self.simulated_time = simulated_time
+        self.service_calls = service_calls
+
+    @property
+    def events(self):
+        return len(self.latencies)
+
+    def as_dict(self):
+        return {
+            'events': self.events,
+            'wall_time_s': round(self.wall_time, 3),
+            'simulated_time_s': round(self.simulated_time, 1),
+            'throughput_events_per_s': round(
+                self.events / self.wall_time if self.wall_time else 0, 1),
+            'p50_ms': round(percentile(self.latencies, 0.5) * 1000, 4),
+            'p99_ms': round(percentile(self.latencies, 0.99) * 1000, 4),
+            'service_calls': dict(sorted(self.service_calls.items()))
+        }
+
+    def format(self):
+        return '\n'.join(f'{key}: {value}'
+                         for key, value in self.as_dict().items())
+
+
+async def async_replay(hass, records):
+    """Feed records to hass at their virtual time. The latency of a record
+    is the CPU time until hass is idle again, including all service calls
+    it caused."""
+    latencies = list()
+    calls_before = hass.services.count_calls()
+    start = hass.loop.time()
+    wall_time = 0.0
+    for record in records:
+        delay = start + record.time - hass.loop.time()
+        if delay > 0:
+            await hass.async_advance(delay)
+        began = time.perf_counter()
+        if record.kind == 'event':
+            await hass.services.async_call('complex_controller',
+                                           'handle_event', {
+                                               'controller': record.target,
+                                               'type': record.value
+                                           })
+        else:
+            hass.states.async_set(record.target, record.value)
+        await hass.async_block_till_done()
+        latency = time.perf_counter() - began
+        wall_time += latency
+        latencies.append(latency)
+    calls = hass.services.count_calls()
+    calls.subtract(calls_before)
+    del calls['complex_controller.handle_event']
+    return ReplayReport(latencies, wall_time, hass.loop.time() - start,
+                        +calls)
+
+
+def make_room_controller(room, dispatch_mode='tree', overrides=0):
+    """Controller config for one room: motion trigger, dim strategy and
+    optional night overrides keyed on input_boolean.{room}_night_{i}."""
+    lights = [f'light.{room}_{i}' for i in range(2)]
+    base = {
+        'type': 'dim',
+        'duration_on': 120,
+        'duration_dim': 30,
+        'action_on': {
+            'service': 'state_enforcer.set_light',
+            'service_data': {
+                'entity_id': lights,
+                'state': 'on',
+                'brightness': 255
+            }
+        },
+        'action_dim': {
+            'service': 'state_enforcer.set_light',
+            'service_data': {
+                'entity_id': lights,
+                'state': 'on',
+                'brightness': 30
+            }
+        },
+        'action_off': {
+            'service': 'state_enforcer.set_light',
+            'service_data': {
+                'entity_id': lights,
+                'state': 'off'
+            }
+        },
+        'overrides': [{
+            'condition': {
+                'condition': 'state',
+                'entity_id': f'input_boolean.{room}_night_{i}',
+                'state': 'on'
+            },
+            'type': 'simple',
+            'duration_on': 60,
+            'action_on': {
+                'service': 'state_enforcer.set_light',
+                'service_data': {
+                    'entity_id': lights[0],
+                    'state': 'on',
+                    'brightness': 5
+                }
+            },
+            'action_off': {
+                'service': 'state_enforcer.set_light',
+                'service_data': {
+                    'entity_id': lights[0],
+                    'state': 'off'
+                }
+            },
+            'overrides': []
+        } for i in range(overrides)]
+    }
+    return {
+        'dispatch_mode': dispatch_mode,
+        'triggers': [{
+            'entity_id': f'binary_sensor.{room}_motion',
+            'to': STATE_ON,
+            'type': 'movement'
+        }],
+        'base': base
+    }, lights
+
+
+async def async_setup_house(hass, rooms, dispatch_mode='tree', overrides=0,
+                            light_latency=0.05):
+    """Both integrations for a house of rooms with two lights each."""
+    lights = FakeLights(hass, latency=light_latency)
+    controllers = dict()
+    entity_ids = list()
+    for room in rooms:
+        controllers[room], room_lights = make_room_controller(
+            room, dispatch_mode, overrides)
+        entity_ids.extend(room_lights)
+        lights.add(*room_lights)
+        hass.states.async_set(f'binary_sensor.{room}_motion', STATE_OFF)
+    assert await hass.async_setup_component('state_enforcer',
+                                            {'state_enforcer': entity_ids})
+    assert await hass.async_setup_component('complex_controller',
+                                            {'complex_controller': controllers})
+    await hass.async_block_till_done()
+    return lights
+
@@ -0,0 +1,5 @@
+"""Minimal stand-in for the parts of Home Assistant used by the integrations.
+
+Only what complex_controller and state_enforcer import is provided, with the
+behaviour they rely on. The fake hass object itself lives in tests/harness.py.
+"""
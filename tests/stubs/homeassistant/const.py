@@ -0,0 +1,22 @@
+"""Constants used by the integrations."""
+MATCH_ALL = '*'
+
+ATTR_ENTITY_ID = 'entity_id'
+ATTR_SERVICE = 'service'
+ATTR_SERVICE_DATA = 'service_data'
+ATTR_STATE = 'state'
+
+CONF_BASE = 'base'
+CONF_CONDITION = 'condition'
+CONF_CONDITIONS = 'conditions'
+CONF_ENTITIES = 'entities'
+CONF_ENTITY_ID = 'entity_id'
+CONF_TYPE = 'type'
+CONF_VALUE_TEMPLATE = 'value_template'
+
+EVENT_STATE_CHANGED = 'state_changed'
+
+STATE_ON = 'on'
+STATE_OFF = 'off'
+STATE_UNAVAILABLE = 'unavailable'
+STATE_UNKNOWN = 'unknown'
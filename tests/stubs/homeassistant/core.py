@@ -0,0 +1,61 @@
+"""Event, State and ServiceCall as seen by the integrations."""
+import types
+
+import homeassistant.util.dt as dt_util
+
+
+def callback(func):
+    """Mark a function as safe to run inside the event loop."""
+    setattr(func, '_hass_callback', True)
+    return func
+
+
+def is_callback(func):
+    return getattr(func, '_hass_callback', False) is True
+
+
+def split_entity_id(entity_id):
+    return entity_id.split('.', 1)
+
+
+def valid_entity_id(entity_id):
+    domain, _, name = entity_id.partition('.')
+    return (domain != '' and name != '' and entity_id == entity_id.lower()
+            and ' ' not in entity_id)
+
+
+class Event(object):
+    def __init__(self, event_type, data=None):
+        self.event_type = event_type
+        self.data = data or dict()
+        self.time_fired = dt_util.utcnow()
+
+    def __repr__(self):
+        return f'<Event {self.event_type}: {self.data}>'
+
+
+class State(object):
+    def __init__(self, entity_id, state, attributes=None, last_changed=None):
+        self.entity_id = entity_id
+        self.domain, self.object_id = split_entity_id(entity_id)
+        self.state = state
+        self.attributes = types.MappingProxyType(dict(attributes or {}))
+        self.last_changed = last_changed or dt_util.utcnow()
+
+    def __eq__(self, other):
+        return (isinstance(other, State) and self.entity_id == other.entity_id
+                and self.state == other.state
+                and self.attributes == other.attributes)
+
+    def __repr__(self):
+        return f'<state {self.entity_id}={self.state}; {dict(self.attributes)}>'
+
+
+class ServiceCall(object):
+    def __init__(self, domain, service, data=None):
+        self.domain = domain
+        self.service = service
+        self.data = types.MappingProxyType(dict(data or {}))
+
+    def __repr__(self):
+        return f'<ServiceCall {self.domain}.{self.service}: {dict(self.data)}>'
@@ -0,0 +1,13 @@
+class HomeAssistantError(Exception):
+    pass
+
+
+class TemplateError(HomeAssistantError):
+    pass
+
+
+class ServiceNotFound(HomeAssistantError):
+    def __init__(self, domain, service):
+        super().__init__(f'Service {domain}.{service} not found')
+        self.domain = domain
+        self.service = service
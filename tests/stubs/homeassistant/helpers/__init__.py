@@ -0,0 +1,2 @@
+# Home Assistant has imported these by the time an integration is set up.
+from . import condition, config_validation, template  # noqa: F401
@@ -0,0 +1,160 @@
+"""Condition checkers for the schemas accepted by config_validation."""
+import datetime
+
+import homeassistant.util.dt as dt_util
+from homeassistant.const import STATE_UNAVAILABLE, STATE_UNKNOWN
+from homeassistant.exceptions import HomeAssistantError
+
+
+async def async_from_config(hass, config, config_validation=True):
+    condition_type = config['condition']
+    factory = _FACTORIES.get(condition_type)
+    if factory is None:
+        raise HomeAssistantError(
+            f'Invalid condition "{condition_type}" specified')
+    nested = [
+        await async_from_config(hass, nested_config, config_validation)
+        for nested_config in config.get('conditions', [])
+    ]
+    return factory(config, nested)
+
+
+def _state(config, nested):
+    expected = config['state']
+    if not isinstance(expected, list):
+        expected = [expected]
+    expected = [str(value) for value in expected]
+
+    def check(hass, variables=None):
+        for entity_id in config['entity_id']:
+            state = hass.states.get(entity_id)
+            if state is None or state.state not in expected:
+                return False
+        return True
+
+    return check
+
+
+def _resolve_number(hass, value):
+    if not isinstance(value, str):
+        return value
+    state = hass.states.get(value)
+    try:
+        return float(state.state)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _numeric_state(config, nested):
+    def check(hass, variables=None):
+        for entity_id in config['entity_id']:
+            state = hass.states.get(entity_id)
+            if state is None or state.state in (STATE_UNAVAILABLE,
+                                                STATE_UNKNOWN):
+                return False
+            try:
+                value = float(state.state)
+            except ValueError:
+                return False
+            above = _resolve_number(hass, config.get('above'))
+            below = _resolve_number(hass, config.get('below'))
+            if above is not None and not value > above:
+                return False
+            if below is not None and not value < below:
+                return False
+        return True
+
+    return check
+
+
+def _template(config, nested):
+    value_template = config['value_template']
+
+    def check(hass, variables=None):
+        value_template.hass = hass
+        result = value_template.async_render(variables)
+        if isinstance(result, str):
+            return result.strip().lower() == 'true'
+        return bool(result)
+
+    return check
+
+
+def _zone(config, nested):
+    """Stands in for the distance check: the tracked entity's state names
+    the zone it is in."""
+    def check(hass, variables=None):
+        zones = [zone.split('.', 1)[1] for zone in config['zone']]
+        for entity_id in config['entity_id']:
+            state = hass.states.get(entity_id)
+            if state is None or state.state not in zones:
+                return False
+        return True
+
+    return check
+
+
+def _resolve_time(hass, value):
+    if isinstance(value, datetime.time):
+        return value
+    state = hass.states.get(value)
+    if state is None:
+        return None
+    parsed = dt_util.parse_time(state.state)
+    if parsed is None:
+        parsed = dt_util.parse_datetime(state.state)
+        parsed = None if parsed is None else parsed.time()
+    return parsed
+
+
+def _time(config, nested):
+    def check(hass, variables=None):
+        now = dt_util.now()
+        now_time = now.time()
+        after = _resolve_time(hass, config.get('after', datetime.time()))
+        before = _resolve_time(
+            hass, config.get('before', datetime.time(23, 59, 59, 999999)))
+        if after is None or before is None:
+            return False
+        if after < before:
+            if not after <= now_time < before:
+                return False
+        elif before <= now_time < after:
+            return False
+        weekday = config.get('weekday')
+        if weekday is not None:
+            days = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+            if isinstance(weekday, str):
+                weekday = [weekday]
+            if days[now.weekday()] not in weekday:
+                return False
+        return True
+
+    return check
+
+
+def _and(config, nested):
+    return lambda hass, variables=None: all(
+        check(hass, variables) for check in nested)
+
+
+def _or(config, nested):
+    return lambda hass, variables=None: any(
+        check(hass, variables) for check in nested)
+
+
+def _not(config, nested):
+    return lambda hass, variables=None: not any(
+        check(hass, variables) for check in nested)
+
+
+_FACTORIES = {
+    'state': _state,
+    'numeric_state': _numeric_state,
+    'template': _template,
+    'time': _time,
+    'zone': _zone,
+    'and': _and,
+    'or': _or,
+    'not': _not
+}
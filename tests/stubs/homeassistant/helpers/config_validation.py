@@ -0,0 +1,135 @@
+"""The validators used by the integrations."""
+import datetime
+import numbers
+
+import voluptuous as vol
+
+import homeassistant.util.dt as dt_util
+from homeassistant.const import (CONF_CONDITION, CONF_CONDITIONS,
+                                 CONF_ENTITY_ID, CONF_VALUE_TEMPLATE)
+from homeassistant.core import valid_entity_id
+from homeassistant.helpers import template as template_helper
+
+
+def string(value):
+    if value is None:
+        raise vol.Invalid('string value is None')
+    if isinstance(value, template_helper.Template):
+        raise vol.Invalid('template value should be a string')
+    return str(value)
+
+
+def boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.lower().strip()
+        if value in ('1', 'true', 'yes', 'on', 'enable'):
+            return True
+        if value in ('0', 'false', 'no', 'off', 'disable'):
+            return False
+    elif isinstance(value, numbers.Number):
+        return value != 0
+    raise vol.Invalid(f'invalid boolean value {value}')
+
+
+def entity_id(value):
+    value = string(value).lower()
+    if valid_entity_id(value):
+        return value
+    raise vol.Invalid(f'Entity ID {value} is an invalid entity id')
+
+
+def entity_ids(value):
+    if value is None:
+        raise vol.Invalid('Entity IDs can not be None')
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',')]
+    return [entity_id(item) for item in value]
+
+
+def time_period(value):
+    if isinstance(value, datetime.timedelta):
+        return value
+    if isinstance(value, numbers.Number):
+        return datetime.timedelta(seconds=value)
+    if isinstance(value, dict):
+        return datetime.timedelta(**value)
+    if isinstance(value, str):
+        try:
+            return datetime.timedelta(seconds=float(value))
+        except ValueError:
+            pass
+        negative = value.startswith('-')
+        parts = value.lstrip('+-').split(':')
+        try:
+            if len(parts) == 2:
+                parts.append('0')
+            hours, minutes, seconds = (float(part) for part in parts)
+        except ValueError as error:
+            raise vol.Invalid(f'Invalid time period {value}') from error
+        offset = datetime.timedelta(hours=hours,
+                                    minutes=minutes,
+                                    seconds=seconds)
+        return -offset if negative else offset
+    raise vol.Invalid(f'Invalid time period {value}')
+
+
+def positive_timedelta(value):
+    if value < datetime.timedelta(0):
+        raise vol.Invalid('Time period should be positive')
+    return value
+
+
+def template(value):
+    if value is None:
+        raise vol.Invalid('template value is None')
+    if isinstance(value, (list, dict, template_helper.Template)):
+        raise vol.Invalid('template value should be a string')
+    compiled = template_helper.Template(str(value))
+    try:
+        compiled.ensure_valid()
+    except Exception as error:
+        raise vol.Invalid(f'invalid template ({error})') from error
+    return compiled
+
+
+def time_or_entity(value):
+    parsed = dt_util.parse_time(str(value))
+    if parsed is not None:
+        return parsed
+    return entity_id(value)
+
+
+def number_or_entity(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return entity_id(value)
+
+
+def condition(value):
+    """Subset of the condition schemas: state, numeric_state, template,
+    time, zone, and, or and not."""
+    if not isinstance(value, dict) or CONF_CONDITION not in value:
+        raise vol.Invalid('expected a condition dictionary')
+    config = dict(value)
+    for key in (CONF_ENTITY_ID, 'zone'):
+        if key in config:
+            config[key] = entity_ids(config[key])
+    if CONF_VALUE_TEMPLATE in config:
+        config[CONF_VALUE_TEMPLATE] = template(config[CONF_VALUE_TEMPLATE])
+    for key in ('above', 'below'):
+        if config[CONF_CONDITION] == 'numeric_state' and key in config:
+            config[key] = number_or_entity(config[key])
+    for key in ('after', 'before'):
+        if config[CONF_CONDITION] == 'time' and key in config:
+            config[key] = time_or_entity(config[key])
+    if CONF_CONDITIONS in config:
+        config[CONF_CONDITIONS] = [
+            condition(nested) for nested in config[CONF_CONDITIONS]
+        ]
+    return config
+
+
+CONDITION_SCHEMA = vol.All(condition)
@@ -0,0 +1,53 @@
+"""Event tracking helpers with the same dispatch shape as Home Assistant:
+one state_changed listener per hass, routed to callbacks by entity id."""
+import homeassistant.util.dt as dt_util
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import callback
+
+_KEYED_LISTENERS = 'track_state_change_event'
+
+
+def async_track_state_change_event(hass, entity_ids, action):
+    if isinstance(entity_ids, str):
+        entity_ids = [entity_ids]
+    entity_ids = [entity_id.lower() for entity_id in entity_ids]
+    keyed = hass.data.get(_KEYED_LISTENERS)
+    if keyed is None:
+        keyed = hass.data[_KEYED_LISTENERS] = dict()
+
+        @callback
+        def on_state_changed(event):
+            for listener in list(keyed.get(event.data['entity_id'], ())):
+                hass.async_run_job(listener, event)
+
+        hass.bus.async_listen(EVENT_STATE_CHANGED, on_state_changed)
+
+    for entity_id in entity_ids:
+        keyed.setdefault(entity_id, list()).append(action)
+
+    def remove_listener():
+        for entity_id in entity_ids:
+            listeners = keyed.get(entity_id)
+            if listeners is not None and action in listeners:
+                listeners.remove(action)
+                if len(listeners) == 0:
+                    del keyed[entity_id]
+
+    return remove_listener
+
+
+def async_track_time_interval(hass, action, interval):
+    seconds = interval.total_seconds()
+    handle = None
+
+    def on_interval():
+        nonlocal handle
+        handle = hass.loop.call_later(seconds, on_interval)
+        hass.async_run_job(action, dt_util.utcnow())
+
+    handle = hass.loop.call_later(seconds, on_interval)
+
+    def remove_listener():
+        handle.cancel()
+
+    return remove_listener
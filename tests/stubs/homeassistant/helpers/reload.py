@@ -0,0 +1,10 @@
+import importlib
+
+
+async def async_integration_yaml_config(hass, integration_name):
+    """Validate the integration's section of hass.yaml_config."""
+    if integration_name not in hass.yaml_config:
+        return dict()
+    module = importlib.import_module(integration_name)
+    return module.CONFIG_SCHEMA(
+        {integration_name: hass.yaml_config[integration_name]})
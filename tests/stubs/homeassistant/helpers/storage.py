@@ -0,0 +1,38 @@
+"""In-memory Store keeping the data in hass.storage."""
+import copy
+
+
+class Store(object):
+    def __init__(self, hass, version, key, private=False):
+        self.hass = hass
+        self.version = version
+        self.key = key
+        self._delay_handle = None
+        self.saves = 0
+
+    async def async_load(self):
+        stored = self.hass.storage.get(self.key)
+        if stored is None:
+            return None
+        return copy.deepcopy(stored['data'])
+
+    async def async_save(self, data):
+        self._write(data)
+
+    def async_delay_save(self, data_func, delay=0):
+        if self._delay_handle is not None:
+            self._delay_handle.cancel()
+        self._delay_handle = self.hass.loop.call_later(
+            delay, self._on_delay_elapsed, data_func)
+
+    def _on_delay_elapsed(self, data_func):
+        self._delay_handle = None
+        self._write(data_func())
+
+    def _write(self, data):
+        self.saves += 1
+        self.hass.storage[self.key] = {
+            'version': self.version,
+            'key': self.key,
+            'data': copy.deepcopy(data)
+        }
@@ -0,0 +1,293 @@
+"""A small template engine standing in for Jinja.
+
+Supports single `{{ expression }}` blocks with Python expression syntax, the
+states(), is_state(), state_attr(), now() and utcnow() functions and the int,
+float, round and default filters. Results are parsed into native types like
+Home Assistant does. Render info records the entities and time access.
+"""
+import ast
+import io
+import keyword
+import re
+import tokenize
+
+import homeassistant.util.dt as dt_util
+from homeassistant.exceptions import TemplateError
+
+_EXPRESSION = re.compile(r'{{(.*?)}}', re.DOTALL)
+_UNSUPPORTED = ('{%', '{#')
+
+
+def is_template_string(maybe_template):
+    return '{{' in maybe_template or any(marker in maybe_template
+                                         for marker in _UNSUPPORTED)
+
+
+def attach(hass, obj):
+    if isinstance(obj, list):
+        for child in obj:
+            attach(hass, child)
+    elif isinstance(obj, dict):
+        for child in obj.values():
+            attach(hass, child)
+    elif isinstance(obj, Template):
+        obj.hass = hass
+
+
+class RenderInfo(object):
+    def __init__(self, template):
+        self.template = template
+        self.entities = set()
+        self.domains = set()
+        self.all_states = False
+        self.has_time = False
+        self.exception = None
+        self._result = None
+
+    def result(self):
+        if self.exception is not None:
+            raise self.exception
+        return self._result
+
+
+class Template(object):
+    def __init__(self, template, hass=None):
+        if not isinstance(template, str):
+            raise TypeError('Expected template to be a string')
+        self.template = template
+        self.hass = hass
+        self._compiled = None
+        self.renders = 0
+
+    def ensure_valid(self):
+        if self._compiled is not None:
+            return
+        if any(marker in self.template for marker in _UNSUPPORTED):
+            raise TemplateError(
+                f'Statements are not supported by the stub: {self.template}')
+        parts = list()
+        position = 0
+        for match in _EXPRESSION.finditer(self.template):
+            parts.append(self.template[position:match.start()])
+            parts.append(self._compile_expression(match.group(1)))
+            position = match.end()
+        parts.append(self.template[position:])
+        if '{{' in self.template[position:]:
+            raise TemplateError(f'Unterminated expression: {self.template}')
+        self._compiled = parts
+
+    def _compile_expression(self, source):
+        try:
+            code = compile(_rewrite_filters(source.strip()), '<template>',
+                           'eval')
+        except (SyntaxError, tokenize.TokenError) as error:
+            raise TemplateError(error) from error
+        return code
+
+    def async_render(self, variables=None):
+        return self.async_render_to_info(variables).result()
+
+    def async_render_to_info(self, variables=None):
+        self.renders += 1
+        render_info = RenderInfo(self)
+        try:
+            self.ensure_valid()
+            environment = self._make_environment(render_info)
+            environment.update(variables or {})
+            rendered = list()
+            for part in self._compiled:
+                if isinstance(part, str):
+                    rendered.append(part)
+                    continue
+                rendered.append(eval(part, {'__builtins__': {}},
+                                     environment))
+            render_info._result = _to_native(rendered)
+        except TemplateError as error:
+            render_info.exception = error
+        except Exception as error:
+            render_info.exception = TemplateError(error)
+        return render_info
+
+    def _make_environment(self, render_info):
+        hass = self.hass
+
+        def get_state(entity_id):
+            render_info.entities.add(entity_id)
+            return hass.states.get(entity_id)
+
+        def states(entity_id):
+            state = get_state(entity_id)
+            return 'unknown' if state is None else state.state
+
+        def is_state(entity_id, value):
+            state = get_state(entity_id)
+            return state is not None and state.state == value
+
+        def state_attr(entity_id, name):
+            state = get_state(entity_id)
+            return None if state is None else state.attributes.get(name)
+
+        def now():
+            render_info.has_time = True
+            return dt_util.now()
+
+        def utcnow():
+            render_info.has_time = True
+            return dt_util.utcnow()
+
+        return {
+            'states': states,
+            'is_state': is_state,
+            'state_attr': state_attr,
+            'now': now,
+            'utcnow': utcnow,
+            'true': True,
+            'false': False,
+            'none': None,
+            'int': int,
+            'float': float,
+            'round': round,
+            'min': min,
+            'max': max,
+            **{
+                f'_filter_{name}': template_filter
+                for name, template_filter in _FILTERS.items()
+            }
+        }
+
+    def __eq__(self, other):
+        return (self.__class__ == other.__class__
+                and self.template == other.template
+                and self.hass == other.hass)
+
+    def __hash__(self):
+        return hash((type(self), self.template))
+
+    def __repr__(self):
+        return f'Template("{self.template}")'
+
+
+def _to_int(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _default(value, default_value=''):
+    return default_value if value is None else value
+
+
+_FILTERS = {
+    'int': _to_int,
+    'float': _to_float,
+    'round': round,
+    'default': _default
+}
+
+
+def _rewrite_filters(source):
+    """Turn `operand | name(args)` into `_filter_name(operand, args)`. As in
+    Jinja, a filter binds to the primary expression on its left."""
+    output = list()
+    tokens = [
+        token for token in tokenize.generate_tokens(
+            io.StringIO(source).readline)
+        if token.type not in (tokenize.NEWLINE, tokenize.NL,
+                              tokenize.ENDMARKER)
+    ]
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token.string != '|':
+            output.append(token)
+            index += 1
+            continue
+        name = tokens[index + 1].string
+        if name not in _FILTERS:
+            raise TemplateError(f'Unknown filter: {name}')
+        index += 2
+        arguments = list()
+        if index < len(tokens) and tokens[index].string == '(':
+            end = _find_closing(tokens, index)
+            arguments = tokens[index + 1:end]
+            index = end + 1
+        start = _find_primary_start(output)
+        operand = output[start:]
+        del output[start:]
+        output.append(f'_filter_{name}(')
+        output.extend(operand)
+        if len(arguments) > 0:
+            output.append(',')
+            output.extend(arguments)
+        output.append(')')
+    return ' '.join(
+        token if isinstance(token, str) else token.string
+        for token in output)
+
+
+def _string(token):
+    return token if isinstance(token, str) else token.string
+
+
+def _find_closing(tokens, index):
+    depth = 0
+    for position in range(index, len(tokens)):
+        if tokens[position].string in '([{':
+            depth += 1
+        elif tokens[position].string in ')]}':
+            depth -= 1
+            if depth == 0:
+                return position
+    raise TemplateError('Unbalanced brackets')
+
+
+def _find_primary_start(output):
+    position = len(output) - 1
+    while position >= 0:
+        current = _string(output[position])
+        if current in (')', ']'):
+            depth = 0
+            while position >= 0:
+                current = _string(output[position])
+                if current in (')', ']'):
+                    depth += 1
+                elif current.endswith('(') or current == '[':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                position -= 1
+            if current.startswith('_filter_'):
+                return position
+        previous = _string(output[position - 1]) if position > 0 else ''
+        if current == '.' or previous == '.':
+            position -= 1
+            continue
+        if current in ('(', '[') and (previous.isidentifier()
+                                      and not keyword.iskeyword(previous)
+                                      or previous in (')', ']')):
+            position -= 1
+            continue
+        return position
+    raise TemplateError('Filter without operand')
+
+
+def _to_native(rendered):
+    rendered = [part for part in rendered if not isinstance(part, str) or part]
+    if len(rendered) == 1 and not isinstance(rendered[0], str):
+        return rendered[0]
+    text = ''.join(str(part) for part in rendered).strip()
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return text
+    if isinstance(value, (int, float, bool, list, dict)):
+        return value
+    return text
@@ -0,0 +1,2 @@
+async def async_setup_component(hass, domain, config):
+    return await hass.async_setup_component(domain, config)
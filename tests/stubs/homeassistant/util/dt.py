@@ -0,0 +1,50 @@
+"""Date helpers. Local time is UTC; tests/harness.py points the clock at the
+virtual event loop time."""
+import datetime
+
+UTC = DEFAULT_TIME_ZONE = datetime.timezone.utc
+
+
+def _real_now():
+    return datetime.datetime.now(UTC)
+
+
+now_func = _real_now
+
+
+def utcnow():
+    return now_func()
+
+
+def now():
+    return utcnow()
+
+
+def as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=UTC)
+    return value.astimezone(UTC)
+
+
+def as_local(value):
+    return as_utc(value)
+
+
+def start_of_local_day(value=None):
+    if value is None:
+        value = now()
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def parse_datetime(value):
+    try:
+        return as_utc(datetime.datetime.fromisoformat(value))
+    except ValueError:
+        return None
+
+
+def parse_time(value):
+    try:
+        return datetime.time.fromisoformat(value)
+    except ValueError:
+        return None
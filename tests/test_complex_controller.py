@@ -0,0 +1,429 @@
+import asyncio
+import copy
+
+import harness
+import pytest
+import voluptuous as vol
+
+import homeassistant.helpers.condition
+
+import complex_controller
+
+LIGHTS = ['light.hall_0', 'light.hall_1']
+
+
+def make_config(**options):
+    config, _ = harness.make_room_controller('hall', overrides=1)
+    config.update(options)
+    return config
+
+
+async def async_set_up(config, hass=None):
+    if hass is None:
+        hass = harness.FakeHass()
+        lights = harness.FakeLights(hass)
+        lights.add(*LIGHTS)
+        hass.states.async_set('binary_sensor.hall_motion', 'off')
+        hass.states.async_set('input_boolean.hall_night_0', 'off')
+        assert await hass.async_setup_component('state_enforcer',
+                                                {'state_enforcer': LIGHTS})
+    assert await hass.async_setup_component('complex_controller',
+                                            {'complex_controller': {
+                                                'hall': config
+                                            }})
+    await hass.async_block_till_done()
+    return hass
+
+
+def controller_state(hass):
+    return hass.states.get('complex_controller.hall').state
+
+
+def set_light_calls(hass):
+    return [
+        call.data for call in hass.services.get_calls('state_enforcer',
+                                                      'set_light')
+    ]
+
+
+async def async_motion(hass):
+    hass.states.async_set('binary_sensor.hall_motion', 'on')
+    await hass.async_block_till_done()
+    hass.states.async_set('binary_sensor.hall_motion', 'off')
+    await hass.async_block_till_done()
+
+
+async def test_motion_turns_on_then_dims_then_off():
+    hass = await async_set_up(make_config())
+    await async_motion(hass)
+    assert controller_state(hass) == 'auto_on'
+    assert hass.states.get('light.hall_0').attributes['brightness'] == 255
+    await hass.async_advance(121)
+    assert controller_state(hass) == 'dim'
+    assert hass.states.get('light.hall_0').attributes['brightness'] == 30
+    await hass.async_advance(31)
+    assert controller_state(hass) == 'off'
+    assert hass.states.get('light.hall_0').state == 'off'
+
+
+async def test_timer_entity_drives_transitions():
+    hass = await async_set_up(make_config(timer='timer.hall'))
+    await async_motion(hass)
+    assert hass.states.get('timer.hall').state == 'active'
+    await hass.async_advance(121)
+    assert controller_state(hass) == 'dim'
+    await hass.async_advance(31)
+    assert controller_state(hass) == 'off'
+    assert len(hass.services.get_calls('timer', 'cancel')) == 0
+
+
+async def test_override_takes_precedence_in_both_modes():
+    for mode in ('tree', 'compiled'):
+        harness.reset_integrations()
+        hass = await async_set_up(make_config(dispatch_mode=mode))
+        hass.states.async_set('input_boolean.hall_night_0', 'on')
+        await async_motion(hass)
+        assert set_light_calls(hass)[-1]['brightness'] == 5, mode
+        await hass.async_advance(61)
+        assert controller_state(hass) == 'off', mode
+
+
+async def test_repeated_motion_only_extends_the_deadline():
+    hass = await async_set_up(make_config())
+    for _ in range(10):
+        await async_motion(hass)
+        await hass.async_advance(60)
+    assert len(set_light_calls(hass)) == 1
+    assert controller_state(hass) == 'auto_on'
+    await hass.async_advance(61)
+    assert controller_state(hass) == 'dim'
+
+
+async def test_event_window_drops_bursts():
+    hass = await async_set_up(make_config(event_window=5, diagnostics=True))
+    for _ in range(5):
+        await hass.services.async_call('complex_controller', 'handle_event', {
+            'controller': 'hall',
+            'type': 'movement'
+        })
+        await hass.async_advance(1)
+    controller = complex_controller.controllers['hall']
+    assert controller.stats.counters['events_coalesced'] == 4
+
+
+async def test_coalescer_merges_calls_across_controllers():
+    hass = harness.FakeHass()
+    harness.FakeLights(hass).add(*LIGHTS)
+    hass.services.async_register('notify', 'notify', lambda call: None)
+    assert await hass.async_setup_component('state_enforcer',
+                                            {'state_enforcer': LIGHTS})
+    hall = make_config(coalesce_window=0.5)
+    hall['base']['action_on'] = [
+        hall['base']['action_on'], {
+            'service': 'notify.notify',
+            'service_data': {
+                'message': 'lights on'
+            }
+        }
+    ]
+    stairs = copy.deepcopy(hall)
+    stairs['priority'] = 1
+    stairs['coalesce_window'] = 1
+    stairs['base']['action_on'][0]['service_data']['brightness'] = 100
+    assert await hass.async_setup_component(
+        'complex_controller',
+        {'complex_controller': {
+            'hall': hall,
+            'stairs': stairs
+        }})
+    def handle_manual_on(name):
+        hass.async_create_task(
+            hass.services.async_call('complex_controller', 'handle_event', {
+                'controller': name,
+                'type': 'manual_on'
+            }))
+
+    handle_manual_on('stairs')
+    hass.loop.call_later(0.2, handle_manual_on, 'hall')
+    await hass.async_advance(2)
+    assert set_light_calls(hass) == [{
+        'entity_id': LIGHTS,
+        'state': 'on',
+        'brightness': 100
+    }]
+    assert len(hass.services.get_calls('notify')) == 1
+
+
+class UnknownTransitionStrategy(complex_controller.HandlerStrategyBase):
+    __slots__ = ()
+
+    @classmethod
+    def register_handlers(cls):
+        cls.set_handler('bogus', 'movement', cls.register_handlers)
+
+
+async def test_conflicting_strategies_fail_setup():
+    make_manual_dispatcher = complex_controller.make_manual_dispatcher
+    for strategy_type in (complex_controller.ManualHandlerStrategy,
+                          UnknownTransitionStrategy):
+        harness.reset_integrations()
+
+        def make_conflicting_dispatcher(dispatcher, config):
+            make_manual_dispatcher(dispatcher, config)
+            dispatcher.add_strategy(strategy_type())
+            return dispatcher
+
+        complex_controller.make_manual_dispatcher = make_conflicting_dispatcher
+        try:
+            with pytest.raises(vol.Invalid):
+                await async_set_up(
+                    make_config(base={
+                        'type': 'manual',
+                        'duration_on': 60
+                    }))
+        finally:
+            complex_controller.make_manual_dispatcher = make_manual_dispatcher
+
+
+async def test_toggle_switches_manual_mode():
+    hass = await async_set_up(make_config())
+    event = {'controller': 'hall', 'type': 'toggle'}
+    await hass.services.async_call('complex_controller', 'handle_event', event)
+    await hass.async_block_till_done()
+    assert controller_state(hass) == 'manual_on'
+    await hass.async_advance(3600)
+    assert controller_state(hass) == 'manual_on'
+    await hass.services.async_call('complex_controller', 'handle_event', event)
+    await hass.async_block_till_done()
+    assert controller_state(hass) == 'off'
+
+
+async def test_failing_handler_keeps_the_timer():
+    hass = await async_set_up(make_config())
+    await async_motion(hass)
+    timer = complex_controller.controllers['hall'].tree_context.timer
+    dispatcher = timer.enrollee
+    set_light = hass.services.services['state_enforcer', 'set_light']
+
+    async def async_fail(call):
+        raise RuntimeError('set_light failed')
+
+    hass.services.async_register('state_enforcer', 'set_light', async_fail)
+    try:
+        await hass.services.async_call('complex_controller', 'handle_event', {
+            'controller': 'hall',
+            'type': 'toggle'
+        })
+    except RuntimeError:
+        pass
+    hass.services.services['state_enforcer', 'set_light'] = set_light
+    assert (timer.enrollee, timer.detached_enrollee,
+            timer.cancel_deferred) == (dispatcher, None, False)
+
+
+async def test_state_and_deadline_survive_restart():
+    hass = await async_set_up(make_config())
+    await async_motion(hass)
+    await hass.async_advance(30)
+    storage = copy.deepcopy(hass.storage)
+    harness.reset_integrations()
+
+    restarted = harness.FakeHass()
+    restarted.storage = storage
+    harness.FakeLights(restarted).add(*LIGHTS, state='on', brightness=255)
+    assert await restarted.async_setup_component('state_enforcer',
+                                                 {'state_enforcer': LIGHTS})
+    await async_set_up(make_config(), restarted)
+    assert controller_state(restarted) == 'auto_on'
+    assert len(restarted.services.get_calls('light')) == 0
+    await restarted.async_advance(100)
+    assert controller_state(restarted) == 'dim'
+
+
+async def test_reload_keeps_unchanged_subtrees():
+    config = make_config()
+    hass = await async_set_up(config)
+    controller = complex_controller.controllers['hall']
+    old_override = controller.root_node.children[0]
+    changed = copy.deepcopy(config)
+    changed['base']['duration_on'] = 30
+    hass.yaml_config['complex_controller'] = {'hall': changed}
+    await hass.services.async_call('complex_controller', 'reload')
+    assert complex_controller.controllers['hall'] is controller
+    assert controller.root_node.children[0] is old_override
+    await async_motion(hass)
+    await hass.async_advance(31)
+    assert controller_state(hass) == 'dim'
+
+
+async def test_reload_keeps_nodes_with_template_conditions():
+    for cache_conditions in (True, False):
+        harness.reset_integrations()
+        config = make_config(cache_conditions=cache_conditions)
+        config['base']['overrides'][0]['condition'] = {
+            'condition': 'template',
+            'value_template': "{{ is_state('input_boolean.hall_night_0', "
+            "'on') }}"
+        }
+        hass = await async_set_up(config)
+        await async_motion(hass)
+        controller = complex_controller.controllers['hall']
+        old_root = controller.root_node
+        hass.yaml_config['complex_controller'] = {'hall': config}
+        await hass.services.async_call('complex_controller', 'reload')
+        assert controller.root_node is old_root
+        await async_motion(hass)
+        assert len(set_light_calls(hass)) == 1
+
+
+async def test_timer_added_on_reload_falls_back_to_a_local_timer():
+    config = make_config()
+    hass = await async_set_up(config)
+    changed = copy.deepcopy(config)
+    changed['timer'] = 'timer.hall'
+    hass.yaml_config['complex_controller'] = {'hall': changed}
+    await hass.services.async_call('complex_controller', 'reload')
+    await async_motion(hass)
+    assert controller_state(hass) == 'auto_on'
+    await hass.async_advance(151)
+    assert controller_state(hass) == 'off'
+    assert hass.states.get('light.hall_0').state == 'off'
+    assert hass.errors == []
+
+
+async def test_templated_service_data_is_rendered_once_per_change():
+    config = make_config()
+    config['base']['action_on']['service_data']['brightness'] = (
+        "{{ states('input_number.level') | int }}")
+    hass = await async_set_up(config)
+    hass.states.async_set('input_number.level', '40')
+    for _ in range(3):
+        await hass.services.async_call('complex_controller', 'handle_event', {
+            'controller': 'hall',
+            'type': 'manual_on'
+        })
+    hass.states.async_set('input_number.level', '90')
+    await hass.services.async_call('complex_controller', 'handle_event', {
+        'controller': 'hall',
+        'type': 'manual_on'
+    })
+    await hass.async_block_till_done()
+    brightness = [call['brightness'] for call in set_light_calls(hass)]
+    assert brightness == [40, 40, 40, 90]
+    controller = complex_controller.controllers['hall']
+    caller = controller.root_node.dispatcher.scene_controller.actions_on[0]
+    assert (caller.template.hits, caller.template.misses) == (2, 2)
+
+
+async def test_condition_cache_invalidates_on_entity_change():
+    hass = await async_set_up(make_config())
+    override = complex_controller.controllers['hall'].root_node.children[0]
+    await async_motion(hass)
+    await async_motion(hass)
+    assert override._condition.misses == 1
+    assert override._condition.hits == 1
+    hass.states.async_set('input_boolean.hall_night_0', 'on')
+    await async_motion(hass)
+    assert override._condition.misses == 2
+    assert set_light_calls(hass)[-1]['brightness'] == 5
+
+
+async def test_zone_condition_is_cached_on_its_entities():
+    config = make_config()
+    config['base']['overrides'][0]['condition'] = {
+        'condition': 'zone',
+        'entity_id': 'person.guest',
+        'zone': 'zone.home'
+    }
+    hass = await async_set_up(config)
+    hass.states.async_set('person.guest', 'away')
+    override = complex_controller.controllers['hall'].root_node.children[0]
+    await async_motion(hass)
+    assert set_light_calls(hass)[-1]['brightness'] == 255
+    hass.states.async_set('person.guest', 'home')
+    await hass.async_advance(200)
+    await async_motion(hass)
+    assert set_light_calls(hass)[-1]['brightness'] == 5
+    assert override._condition.tracked_entities == {'person.guest',
+                                                    'zone.home'}
+
+
+async def test_numeric_state_bound_by_an_entity_is_tracked():
+    config = make_config()
+    config['base']['overrides'][0]['condition'] = {
+        'condition': 'numeric_state',
+        'entity_id': 'sensor.hall_lux',
+        'below': 'input_number.hall_lux_threshold'
+    }
+    hass = await async_set_up(config)
+    hass.states.async_set('sensor.hall_lux', '20')
+    hass.states.async_set('input_number.hall_lux_threshold', '10')
+    await async_motion(hass)
+    assert set_light_calls(hass)[-1]['brightness'] == 255
+    hass.states.async_set('input_number.hall_lux_threshold', '30')
+    await hass.async_advance(200)
+    await async_motion(hass)
+    assert set_light_calls(hass)[-1]['brightness'] == 5
+
+
+async def test_time_condition_on_an_entity_is_not_cached():
+    config = make_config()
+    config['base']['overrides'][0]['condition'] = {
+        'condition': 'time',
+        'after': 'input_datetime.hall_night_start'
+    }
+    hass = await async_set_up(config)
+    hass.states.async_set('input_datetime.hall_night_start', '00:30:00')
+    override = complex_controller.controllers['hall'].root_node.children[0]
+    await async_motion(hass)
+    assert set_light_calls(hass)[-1]['brightness'] == 255
+    await hass.async_advance(1800)
+    await async_motion(hass)
+    assert set_light_calls(hass)[-1]['brightness'] == 5
+    assert override._condition.hits == 0
+
+
+async def test_template_condition_is_rendered_once_per_miss():
+    config = make_config()
+    config['base']['overrides'][0]['condition'] = {
+        'condition': 'or',
+        'conditions': [{
+            'condition': 'state',
+            'entity_id': 'input_boolean.hall_night_0',
+            'state': 'on'
+        }, {
+            'condition': 'template',
+            'value_template': "{{ states('input_number.lux') | int < 10 }}"
+        }]
+    }
+    hass = await async_set_up(config)
+    hass.states.async_set('input_number.lux', '50')
+    override = complex_controller.controllers['hall'].root_node.children[0]
+    await async_motion(hass)
+    await async_motion(hass)
+    template, _ = override._condition.render_infos[0]
+    assert (override._condition.misses, template.renders) == (1, 1)
+    hass.states.async_set('input_number.lux', '5')
+    await async_motion(hass)
+    assert (override._condition.misses, template.renders) == (2, 2)
+    assert set_light_calls(hass)[-1]['brightness'] == 5
+
+
+async def test_concurrent_events_compile_a_condition_once():
+    hass = await async_set_up(make_config())
+    override = complex_controller.controllers['hall'].root_node.children[0]
+    async_from_config = homeassistant.helpers.condition.async_from_config
+    compiled = list()
+
+    async def async_slow_from_config(*args, **kwargs):
+        compiled.append(args[1])
+        await asyncio.sleep(0)
+        return await async_from_config(*args, **kwargs)
+
+    homeassistant.helpers.condition.async_from_config = async_slow_from_config
+    try:
+        await asyncio.gather(override.async_check_condition(),
+                             override.async_check_condition())
+    finally:
+        homeassistant.helpers.condition.async_from_config = async_from_config
+    assert len(compiled) == 1
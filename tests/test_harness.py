@@ -0,0 +1,34 @@
+import asyncio
+
+from homeassistant.helpers.event import async_track_state_change_event
+from homeassistant.helpers.template import Template
+
+import harness
+
+
+async def test_virtual_clock_runs_timers_without_waiting():
+    hass = harness.FakeHass()
+    fired = list()
+    hass.loop.call_later(3600, fired.append, 'late')
+    await hass.async_advance(3601)
+    assert fired == ['late']
+    assert hass.loop.time() >= 3601
+
+
+async def test_state_machine_skips_unchanged_writes():
+    hass = harness.FakeHass()
+    events = list()
+    async_track_state_change_event(hass, ['light.a'], events.append)
+    hass.states.async_set('light.a', 'on', {'brightness': 3})
+    hass.states.async_set('light.a', 'on', {'brightness': 3})
+    hass.states.async_set('light.b', 'on')
+    assert len(events) == 1
+
+
+async def test_template_tracks_entities():
+    hass = harness.FakeHass()
+    hass.states.async_set('input_number.level', '40')
+    template = Template("{{ states('input_number.level') | int + 1 }}", hass)
+    render_info = template.async_render_to_info()
+    assert render_info.result() == 41
+    assert render_info.entities == {'input_number.level'}
@@ -0,0 +1,300 @@
+import copy
+
+import harness
+
+import state_enforcer
+
+LIGHTS = ['light.a', 'light.b', 'light.c']
+
+
+async def async_set_up(config=None, lights=None, hass=None):
+    if hass is None:
+        hass = harness.FakeHass()
+    if lights is None:
+        lights = harness.FakeLights(hass)
+        lights.add(*LIGHTS)
+    if config is None:
+        config = LIGHTS
+    assert await hass.async_setup_component('state_enforcer',
+                                            {'state_enforcer': config})
+    return hass, lights
+
+
+def light_calls(hass):
+    return [(call.service, call.data)
+            for call in hass.services.get_calls('light')]
+
+
+async def async_set_light(hass, **data):
+    await hass.services.async_call('state_enforcer', 'set_light', data)
+    await hass.async_block_till_done()
+
+
+async def test_set_light_groups_entities_into_one_call():
+    hass, _ = await async_set_up()
+    await async_set_light(hass, entity_id=LIGHTS, state='on', brightness=100)
+    assert light_calls(hass) == [('turn_on', {
+        'brightness': 100,
+        'entity_id': LIGHTS
+    })]
+    await hass.async_advance(10)
+    assert all(
+        hass.states.get(entity_id).attributes['brightness'] == 100
+        for entity_id in LIGHTS)
+    assert len(light_calls(hass)) == 1
+
+
+async def test_unresponsive_light_is_retried_until_the_budget_is_spent():
+    hass, lights = await async_set_up({'entities': LIGHTS, 'max_retries': 3})
+    lights.unresponsive.add('light.a')
+    await async_set_light(hass, entity_id='light.a', state='on')
+    await hass.async_advance(600)
+    assert len(light_calls(hass)) == 4
+    assert state_enforcer.state_enforcers['light.a'].gave_up
+
+
+async def test_confirmed_target_restores_the_retry_budget():
+    hass, lights = await async_set_up({'entities': LIGHTS, 'max_retries': 3})
+    enforcer = state_enforcer.state_enforcers['light.a']
+    lights.unresponsive.add('light.a')
+    hass.loop.call_later(5, lights.unresponsive.clear)
+    await async_set_light(hass, entity_id='light.a', state='on')
+    await hass.async_advance(600)
+    assert enforcer.total_retries > 0
+    assert hass.states.get('light.a').state == 'on'
+    assert enforcer.retry_number == 0
+
+
+async def test_reconciler_restores_the_retry_budget():
+    hass, lights = await async_set_up({
+        'entities': LIGHTS,
+        'max_retries': 2,
+        'reconcile_interval': 10
+    })
+    enforcer = state_enforcer.state_enforcers['light.a']
+    lights.unresponsive.add('light.a')
+    await async_set_light(hass, entity_id='light.a', state='on')
+    await hass.async_advance(60)
+    assert enforcer.gave_up
+    lights.unresponsive.clear()
+    hass.states.async_set('light.a', 'on', {'brightness': 255})
+    await hass.async_advance(10)
+    assert not enforcer.gave_up
+    calls = len(light_calls(hass))
+    hass.states.async_set('light.a', 'off')
+    await hass.async_advance(11)
+    assert len(light_calls(hass)) == calls + 1
+    assert hass.states.get('light.a').state == 'on'
+
+
+async def test_external_drift_is_corrected_after_debounce():
+    hass, _ = await async_set_up()
+    await async_set_light(hass, entity_id='light.a', state='on', brightness=80)
+    await hass.async_advance(10)
+    hass.states.async_set('light.a', 'off')
+    await hass.async_advance(0.1)
+    assert len(light_calls(hass)) == 1
+    await hass.async_advance(10)
+    assert len(light_calls(hass)) == 2
+    assert hass.states.get('light.a').state == 'on'
+
+
+async def test_no_op_call_does_not_skew_learned_latency():
+    hass, _ = await async_set_up()
+    for _ in range(2):
+        await async_set_light(hass, entity_id='light.a', state='on')
+        await hass.async_advance(10)
+    await hass.async_advance(3600)
+    hass.states.async_set('light.a', 'on', {
+        'brightness': 255,
+        'color_temp': 300
+    })
+    await hass.async_advance(1)
+    enforcer = state_enforcer.state_enforcers['light.a']
+    assert max(enforcer.latency.samples) < 1
+    assert enforcer.get_confirmation_delay() < 1
+    enforcer.latency.samples.extend([600] * 20)
+    assert enforcer.get_confirmation_delay() == state_enforcer.LATENCY_MAX
+
+
+async def test_unavailable_entity_is_enforced_once_it_returns():
+    for config in (LIGHTS, {'entities': LIGHTS, 'reconcile_interval': 10}):
+        harness.reset_integrations()
+        hass, _ = await async_set_up(config)
+        await async_set_light(hass, entity_id='light.a', state='on')
+        await hass.async_advance(10)
+        hass.states.async_set('light.a', 'unavailable')
+        await hass.async_advance(60)
+        assert len(light_calls(hass)) == 1
+        assert state_enforcer.state_enforcers['light.a'].retry_number == 0
+        hass.states.async_set('light.a', 'off')
+        await hass.async_advance(11)
+        assert len(light_calls(hass)) == 2
+        assert hass.states.get('light.a').state == 'on'
+
+
+async def test_set_many_applies_per_entity_light_targets():
+    hass, _ = await async_set_up()
+    await hass.services.async_call(
+        'state_enforcer', 'set_many', {
+            'targets': [{
+                'entity_id': 'light.a',
+                'state': 'on',
+                'brightness': 10
+            }, {
+                'entity_id': ['light.b', 'light.c'],
+                'state': 'on',
+                'brightness': 20
+            }]
+        })
+    await hass.async_advance(10)
+    assert sorted(light_calls(hass), key=str) == [
+        ('turn_on', {
+            'brightness': 10,
+            'entity_id': ['light.a']
+        }),
+        ('turn_on', {
+            'brightness': 20,
+            'entity_id': ['light.b', 'light.c']
+        }),
+    ]
+
+
+async def test_set_many_accepts_set_state_targets():
+    hass, _ = await async_set_up(LIGHTS + ['climate.hall'])
+    hass.states.async_set('climate.hall', 'heat', {'temperature': 18})
+
+    def on_set_temperature(call):
+        for entity_id in call.data['entity_id']:
+            hass.states.async_set(entity_id, 'heat',
+                                  {'temperature': call.data['temperature']})
+
+    hass.services.async_register('climate', 'set_temperature',
+                                 on_set_temperature)
+    await hass.services.async_call(
+        'state_enforcer', 'set_many', {
+            'targets': [{
+                'entity_id': 'climate.hall',
+                'service': 'climate.set_temperature',
+                'service_data': {
+                    'entity_id': 'climate.hall',
+                    'temperature': 21
+                },
+                'state': 'heat',
+                'state_attributes': {
+                    'temperature': 21
+                }
+            }, {
+                'entity_id': 'light.a',
+                'state': 'on'
+            }]
+        })
+    await hass.async_advance(10)
+    calls = hass.services.get_calls('climate')
+    assert len(calls) == 1
+    assert calls[0].data['temperature'] == 21
+    assert hass.states.get('climate.hall').attributes['temperature'] == 21
+    assert light_calls(hass) == [('turn_on', {'entity_id': ['light.a']})]
+
+
+async def test_rate_limit_spaces_calls_and_prefers_targets():
+    hass, lights = await async_set_up({
+        'entities': LIGHTS,
+        'rate_limits': {
+            'light': {
+                'rate': 2,
+                'burst': 1
+            }
+        }
+    })
+    lights.unresponsive.add('light.a')
+    await async_set_light(hass, entity_id='light.a', state='on')
+    await hass.async_advance(20)
+    retries_before = len(light_calls(hass))
+    hass.async_create_task(
+        hass.services.async_call('state_enforcer', 'set_light', {
+            'entity_id': 'light.b',
+            'state': 'on'
+        }))
+    await hass.async_advance(1)
+    calls = hass.services.get_calls('light')
+    times = [call.time for call in calls]
+    assert all(later - earlier >= 0.5 - 1e-9
+               for earlier, later in zip(times, times[1:]))
+    assert ['light.b'] in [call.data['entity_id'] for call in
+                           calls[retries_before:retries_before + 2]]
+
+
+async def test_transition_is_not_retried_while_fading():
+    hass, _ = await async_set_up()
+    await async_set_light(hass,
+                          entity_id='light.a',
+                          state='on',
+                          brightness=200,
+                          transition=20)
+    await hass.async_advance(30)
+    assert len(light_calls(hass)) == 1
+    assert light_calls(hass)[0][1]['transition'] == 20
+    assert hass.states.get('light.a').attributes['brightness'] == 200
+
+
+async def test_lights_reporting_the_final_state_first_are_not_retried():
+    hass = harness.FakeHass()
+    lights = harness.FakeLights(hass, final_first=True)
+    lights.add(*LIGHTS)
+    await async_set_up(lights=lights, hass=hass)
+    await async_set_light(hass,
+                          entity_id='light.a',
+                          state='on',
+                          brightness=200,
+                          transition=20)
+    await hass.async_advance(30)
+    assert len(light_calls(hass)) == 1
+    assert hass.states.get('light.a').attributes['brightness'] == 200
+
+
+async def test_reconciler_batches_corrections():
+    hass, _ = await async_set_up({
+        'entities': LIGHTS,
+        'reconcile_interval': 10
+    })
+    await async_set_light(hass, entity_id=LIGHTS, state='on', brightness=50)
+    await hass.async_advance(5)
+    assert all(enforcer.task is None
+               for enforcer in state_enforcer.state_enforcers.values())
+    hass.states.async_set('light.a', 'off')
+    hass.states.async_set('light.b', 'on', {'brightness': 3})
+    await hass.async_advance(10)
+    assert light_calls(hass)[1:] == [('turn_on', {
+        'brightness': 50,
+        'entity_id': ['light.a', 'light.b']
+    })]
+
+
+async def test_targets_survive_restart_without_calls():
+    hass, _ = await async_set_up()
+    await async_set_light(hass, entity_id='light.a', state='on', brightness=80)
+    await hass.async_advance(30)
+    storage = copy.deepcopy(hass.storage)
+    harness.reset_integrations()
+
+    restarted = harness.FakeHass()
+    restarted.storage = storage
+    lights = harness.FakeLights(restarted)
+    lights.add(*LIGHTS)
+    await async_set_up(lights=lights, hass=restarted)
+    await restarted.async_advance(30)
+    assert len(light_calls(restarted)) == 0
+    restarted.states.async_set('light.a', 'on', {'brightness': 1})
+    await restarted.async_advance(30)
+    assert light_calls(restarted) == [('turn_on', {
+        'brightness': 80,
+        'entity_id': 'light.a'
+    })]
+
+
+async def test_reload_adds_and_removes_enforcers():
+    hass, _ = await async_set_up()
+    hass.yaml_config['state_enforcer'] = ['light.a', 'light.d']
+    await hass.services.async_call('state_enforcer', 'reload')
+    assert sorted(state_enforcer.state_enforcers) == ['light.a', 'light.d']